@@ -1,14 +1,14 @@
 from agency_swarm.agents import Agent
 from agency_swarm.tools import BaseTool
 from pydantic import Field
+from typing import Optional
 import os
-from openai import OpenAI
-import requests
-from fpdf import FPDF
-
-# Instantiate the OpenAI client
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY")  # The API key is retrieved from the environment variable
+import uuid
+from .tools.util import (
+    DEFAULT_THUMBNAIL_WIDTHS, JOB_ID_PATTERN, Book, EbookPDFWriter, GenerationJournal, ParallelPDFWriter, Pipeline,
+    describe_optimization, generate_ebook, get_artifact_store, get_cover_store, get_http_session,
+    iter_ebook_chapters, optimize_pdf, prepare_cover_image, render_ebook_pdf, resolve_content, resolve_cover_image,
+    stream_ebook_chapters
 )
 
 class EbookContentGenerator(BaseTool):
@@ -36,45 +36,86 @@ class EbookContentGenerator(BaseTool):
     tone: str = Field(
         ..., description="The desired tone (e.g., 'serious', 'humorous', 'inspirational')."
     )
+    max_concurrency: int = Field(
+        8, description="The maximum number of paragraph requests sent to the API at the same time."
+    )
+    batch_sections: bool = Field(
+        False, description="Whether to request all paragraphs of a section in a single API call."
+    )
+    use_cache: bool = Field(
+        True, description="Whether to reuse previously generated paragraphs from the local completion cache."
+    )
+    hedge_requests: bool = Field(
+        False, description="Whether to send a duplicate request when a paragraph takes much longer than usual."
+    )
+    job_id: Optional[str] = Field(
+        None, pattern=JOB_ID_PATTERN, description="Identifier of a resumable generation job. Paragraphs finished by an earlier run of the same job are reused."
+    )
 
     def run(self):
         """
-        Generates the ebook content based on the provided parameters.
-        """
-        ebook_content = f"Title: {self.topic}\n\n"
-        
-        for chapter_num in range(1, self.chapters + 1):
-            ebook_content += f"Chapter {chapter_num}: {self.topic} - Part {chapter_num}\n\n"
-            
-            for section_num in range(1, self.sections_per_chapter + 1):
-                ebook_content += f"Section {chapter_num}.{section_num}: {self.topic} - Section {section_num}\n\n"
-                
-                for paragraph_num in range(1, self.paragraphs_per_section + 1):
-                    prompt = (
-                        f"Write a {self.writing_style} and {self.tone} paragraph about {self.topic} "
-                        f"for Chapter {chapter_num}, Section {section_num}, Paragraph {paragraph_num}."
-                    )
-                    
-                    # Generate text using the OpenAI chat completion API
-                    response = client.chat.completions.create(
-                        model="gpt-4",
-                        messages=[
-                            {"role": "system", "content": "You are a helpful assistant."},
-                            {"role": "user", "content": prompt}
-                        ],
-                        max_tokens=150,
-                        temperature=0.7
-                    )
-                    generated_text = response.choices[0].message.content.strip()
-                    ebook_content += f"{generated_text}\n\n"
-        
-        return ebook_content
+        Generates the ebook content based on the provided parameters. Paragraphs are
+        requested concurrently and reassembled in order. The text is put in the artifact
+        store under the job's manifest and only its handle and a summary are returned, so
+        the book never has to pass through the conversation.
+        """
+        book = self.build_book()
+        store = get_artifact_store()
+        job_id = self.job_id or uuid.uuid4().hex
+        handle = store.attach(job_id, "content", store.put_text(book.to_text()))
+        return f"Ebook content generated: {handle}\nJob ID: {job_id}\n{book.summary()}"
+
+    def build_book(self, on_chapter=None):
+        """
+        Generates the ebook content as a structured Book document. `on_chapter` is called
+        with each chapter, in order, as soon as it is complete.
+        """
+        return generate_ebook(**self._generation_options(), on_chapter=on_chapter)
+
+    def iter_chapters(self, prefetch_chapters=1):
+        """
+        Streams the ebook chapter by chapter, yielding each chapter in order as soon as it is
+        generated. At most `prefetch_chapters` chapters are generated ahead of the consumer.
+        """
+        return iter_ebook_chapters(**self._generation_options(), prefetch_chapters=prefetch_chapters)
+
+    def stream_chapters(self, prefetch_chapters=1):
+        """
+        Async iterator version of `iter_chapters` for callers running in an event loop.
+        """
+        return stream_ebook_chapters(**self._generation_options(), prefetch_chapters=prefetch_chapters)
+
+    def _generation_options(self):
+        return dict(
+            topic=self.topic,
+            chapters=self.chapters,
+            sections_per_chapter=self.sections_per_chapter,
+            paragraphs_per_section=self.paragraphs_per_section,
+            writing_style=self.writing_style,
+            tone=self.tone,
+            max_concurrency=self.max_concurrency,
+            batch_sections=self.batch_sections,
+            use_cache=self.use_cache,
+            journal=GenerationJournal(self.job_id, parameters=self.job_parameters()) if self.job_id else None,
+            hedge_requests=self.hedge_requests
+        )
+
+    def job_parameters(self):
+        """Returns the parameters that decide the text, which a resumed job must keep."""
+        return dict(
+            topic=self.topic,
+            chapters=self.chapters,
+            sections_per_chapter=self.sections_per_chapter,
+            paragraphs_per_section=self.paragraphs_per_section,
+            writing_style=self.writing_style,
+            tone=self.tone
+        )
 
 class EbookCoverGenerator(BaseTool):
     """
     This tool generates an ebook cover using the DALL·E 3 image generation API.
     It takes a prompt describing the desired cover and allows customization of
-    image quality, size, and style.
+    image quality, size, and style. It returns the artifact handle of the cover image.
     """
 
     prompt: str = Field(
@@ -90,12 +131,35 @@ class EbookCoverGenerator(BaseTool):
         "vivid", description="The style of the generated image. Options: 'vivid', 'natural'."
     )
 
+    use_cache: bool = Field(
+        True, description="Whether to reuse a cover previously generated with exactly the same parameters."
+    )
+    job_id: Optional[str] = Field(
+        None, pattern=JOB_ID_PATTERN, description="Identifier of the ebook job the cover belongs to. A new job is created when omitted."
+    )
+
     def run(self):
         """
         Generates an ebook cover image using the provided prompt and specified
-        quality, size, and style parameters.
+        quality, size, and style parameters, and returns the artifact handle of the image,
+        attached to the job's manifest. Covers are stored by their generation parameters,
+        so identical requests are served from the local cover store without calling the API.
+        """
+        store = get_artifact_store()
+        return store.attach(self.job_id or uuid.uuid4().hex, "cover", store.put_file(self.generate_cover()))
+
+    def generate_cover(self):
         """
-        api_url = "https://api.openai.com/v1/images/generations"
+        Generates the cover image, or reuses the stored one, and returns its local path.
+        """
+        store = get_cover_store()
+        key = store.key(model="dall-e-3", prompt=self.prompt, quality=self.quality, size=self.size, style=self.style)
+        cached_path = store.get(key) if self.use_cache else None
+        if cached_path:
+            return cached_path
+
+        base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+        api_url = f"{base_url}/images/generations"
         headers = {
             "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}",
             "Content-Type": "application/json"
@@ -110,11 +174,12 @@ class EbookCoverGenerator(BaseTool):
             "response_format": "url"
         }
 
-        response = requests.post(api_url, headers=headers, json=data)
+        response = get_http_session().post(api_url, headers=headers, json=data)
 
         if response.status_code == 200:
             image_url = response.json().get("data", [])[0].get("url")
-            return image_url
+            # The generated URL expires, so the image itself is stored
+            return store.put_url(key, image_url)
         else:
             raise Exception(f"Failed to generate ebook cover: {response.status_code} - {response.text}")
 
@@ -126,72 +191,48 @@ class EbookPDFGenerator(BaseTool):
     """
 
     cover_image_url: str = Field(
-        ..., description="URL of the cover image to be included in the ebook."
+        ..., description="URL, local file path or artifact handle of the cover image to be included in the ebook."
     )
     content: str = Field(
-        ..., description="The content of the ebook, including chapters, sections, and paragraphs."
+        ..., description="Artifact handle returned by EbookContentGenerator, or the content of the ebook itself, including chapters, sections, and paragraphs."
+    )
+    job_id: Optional[str] = Field(
+        None, pattern=JOB_ID_PATTERN, description="Identifier of the ebook job the PDF belongs to. A new job is created when omitted."
     )
-    output_filename: str = Field(
-        "ebook.pdf", description="The name of the output PDF file."
+    parallel_render: bool = Field(
+        True, description="Whether to lay out chapters in parallel worker processes. Disable to lay out the whole book in a single process."
+    )
+    use_cache: bool = Field(
+        True, description="Whether to reuse the layout of chapters that did not change since an earlier render. Requires parallel_render."
+    )
+    table_of_contents: bool = Field(
+        True, description="Whether to add a table of contents page before the first chapter. Chapters and sections always get PDF bookmarks."
+    )
+    optimize_for_web: bool = Field(
+        True, description="Whether to compact and linearize the PDF (fast web view) so its first page can be shown while it downloads. The result reports the size before and after."
     )
 
     def run(self):
         """
-        Generates a PDF ebook with the provided cover image and content.
+        Generates a PDF ebook with the provided cover image and content. The PDF is kept in
+        the artifact store under the job's manifest.
         """
-        # Fetch the cover image from the provided URL
-        cover_image_filename = "cover_image.jpg"
-        try:
-            response = requests.get(self.cover_image_url)
-            if response.status_code == 200:
-                with open(cover_image_filename, 'wb') as img_file:
-                    img_file.write(response.content)
-            else:
-                raise Exception(f"Failed to fetch the cover image: {response.status_code} - {response.text}")
-        except Exception as e:
-            raise Exception(f"Error occurred while fetching the cover image: {str(e)}")
-        
-        # Initialize the PDF
-        pdf = FPDF()
-        pdf.set_auto_page_break(auto=True, margin=15)
-
-        # Add cover page
-        pdf.add_page()
-        pdf.image(cover_image_filename, x=10, y=10, w=pdf.w - 20)
-
-        # Add title page
-        pdf.add_page()
-        pdf.set_font("Arial", size=24)
-        pdf.multi_cell(0, 10, self.content.split('\n')[0], align="C")  # Title from content
-        
-        # Add content pages
-        pdf.set_font("Arial", size=12)
-        content_lines = self.content.split('\n')
-        for line in content_lines[1:]:
-            if line.startswith("Chapter"):
-                pdf.add_page()
-                pdf.set_font("Arial", size=18, style='B')
-                pdf.cell(0, 10, line, ln=True)
-                pdf.set_font("Arial", size=12)
-            elif line.startswith("Section"):
-                pdf.set_font("Arial", size=14, style='B')
-                pdf.cell(0, 10, line, ln=True)
-                pdf.set_font("Arial", size=12)
-            else:
-                pdf.multi_cell(0, 10, line)
-        
-        # Save the PDF to the specified output file
-        try:
-            pdf.output(self.output_filename)
-            return f"PDF ebook generated successfully: {self.output_filename}"
-        except Exception as e:
-            raise Exception(f"Failed to generate PDF ebook: {str(e)}")
+        content = resolve_content(self.content)
+        cover_image_filename = resolve_cover_image(self.cover_image_url)
+        store = get_artifact_store()
+        pdf_path = store.temp_path(".pdf")
+        result = render_ebook_pdf(Book.from_text(content), cover_image_filename, pdf_path,
+                                  parallel=self.parallel_render, use_cache=self.use_cache,
+                                  toc=self.table_of_contents, optimize=self.optimize_for_web)
+        job_id = self.job_id or uuid.uuid4().hex
+        handle = store.attach(job_id, "pdf", store.put_file(pdf_path, move=True))
+        return result.replace(pdf_path, store.path(handle)) + f"\nArtifact: {handle}\nJob ID: {job_id}"
 
 class EbookGenerationAgent(Agent):
     def __init__(self, **kwargs):
         super().__init__(
             name="EbookGenerationAgent",
-            description="This agent generates engaging ebook content, designs ebook covers, and compiles them into a well-formatted PDF.",
+            description="This agent generates engaging ebook content, designs ebook covers, and compiles them into a well-formatted PDF, EPUB and HTML ebook.",
             instructions="./instructions.md",
             files_folder="./files",
             schemas_folder="./schemas",
@@ -200,38 +241,95 @@ class EbookGenerationAgent(Agent):
             **kwargs
         )
 
-    def create_ebook(self, topic, chapters, sections_per_chapter, paragraphs_per_section, writing_style, tone):
+    def create_ebook(self, topic, chapters, sections_per_chapter, paragraphs_per_section, writing_style, tone,
+                     job_id=None, parallel_render=True, optimize_for_web=True):
         """
         Orchestrates the generation of the entire ebook including content, cover, and PDF compilation.
+        The cover is generated while the content is being written, and chapters are streamed into
+        the PDF layout as soon as they are complete, so only the final save waits for both.
+        Progress is journaled under the given `job_id`; calling this again with the same `job_id`
+        resumes the job and skips every paragraph, cover and PDF step that already finished; the
+        book's parameters must be the same, or ValueError is raised. A `job_id` may only contain
+        letters, digits, '_' and '-'. Without a `job_id` a new one is created; it is part of the
+        result and of the error of a failed job.
+        The content, cover and PDF are kept in the artifact store under the job's manifest, so
+        jobs never share output files and any number of them can run side by side. Blobs that
+        no manifest refers to are garbage collected once the job is done.
+        With `parallel_render`, chapters are laid out in worker processes as they stream in, and
+        with `optimize_for_web`, the PDF is compacted and linearized before it is stored.
         """
-        # Step 1: Generate the ebook content
         content_tool = EbookContentGenerator(
             topic=topic,
             chapters=chapters,
             sections_per_chapter=sections_per_chapter,
             paragraphs_per_section=paragraphs_per_section,
             writing_style=writing_style,
-            tone=tone
-        )
-        content = content_tool.run()
-        
-        # Step 2: Generate the ebook cover
-        cover_tool = EbookCoverGenerator(
-            prompt=f"A beautiful cover for an ebook titled '{topic}', designed with a {tone} tone.",
-            quality="hd",
-            size="1024x1024",
-            style="vivid"
+            tone=tone,
+            job_id=job_id or uuid.uuid4().hex
         )
-        cover_image_url = cover_tool.run()
-        
-        # Step 3: Compile the content and cover into a PDF
-        pdf_tool = EbookPDFGenerator(
-            cover_image_url=cover_image_url,
-            content=content,
-            output_filename="final_ebook.pdf"
+        # Refuses to resume a job that was started for a different book
+        journal = GenerationJournal(content_tool.job_id, parameters=content_tool.job_parameters())
+        store = get_artifact_store()
+
+        finished_pdf = journal.pdf()
+        if finished_pdf:
+            return finished_pdf["result"]
+
+        def generate_and_layout():
+            # Chapters are streamed into the layout and the content artifact, so the full text is never held in memory
+            writer = ParallelPDFWriter(topic) if parallel_render else EbookPDFWriter(topic)
+            content_path = store.temp_path(".txt")
+            with open(content_path, "w", encoding="utf-8") as content_file:
+                content_file.write(f"Title: {topic}\n\n")
+                for chapter in content_tool.iter_chapters(prefetch_chapters=2):
+                    writer.add_chapter(chapter)
+                    content_file.write(chapter.to_text())
+            store.attach(journal.job_id, "content", store.put_file(content_path, move=True))
+            return writer
+
+        def generate_cover():
+            handle = store.get(journal.job_id, "cover")
+            if handle is None:
+                cover_tool = EbookCoverGenerator(
+                    prompt=f"A beautiful cover for an ebook titled '{topic}', designed with a {tone} tone.",
+                    quality="hd",
+                    size="1024x1024",
+                    style="vivid",
+                    job_id=journal.job_id
+                )
+                handle = cover_tool.run()
+            # The PDF cover and the landing page thumbnails are derived while the content is still generating
+            cover_images = prepare_cover_image(store.path(handle), thumbnail_widths=DEFAULT_THUMBNAIL_WIDTHS)
+            for width, thumbnail_path in cover_images["thumbnails"].items():
+                store.attach(journal.job_id, f"thumbnail_{width}", store.put_file(thumbnail_path))
+            return store.path(handle)
+
+        def save_pdf(layout, cover):
+            pdf_path = store.temp_path(".pdf")
+            layout.save(cover, pdf_path)
+            optimization = describe_optimization(optimize_pdf(pdf_path)) if optimize_for_web else None
+            handle = store.attach(journal.job_id, "pdf", store.put_file(pdf_path, move=True))
+            output_filename = store.path(handle)
+            pdf_result = f"PDF ebook generated successfully: {output_filename}\nJob ID: {journal.job_id}"
+            if optimization:
+                pdf_result += f"\nOptimized for web: {optimization}"
+            journal.record_pdf(output_filename, pdf_result)
+            return pdf_result
+
+        pipeline = (
+            Pipeline()
+            .add("layout", generate_and_layout)
+            .add("cover", generate_cover)
+            .add("pdf", save_pdf, depends_on=("layout", "cover"))
         )
-        pdf_result = pdf_tool.run()
-        
+        try:
+            pdf_result = pipeline.run()["pdf"]
+        except Exception as e:
+            raise Exception(
+                f"Ebook job {journal.job_id} failed, call create_ebook again with this job_id to resume it: {e}"
+            ) from e
+        # Every artifact of this job is attached by now, so whatever no job refers to can go
+        store.gc()
         return pdf_result
 
     def response_validator(self, message):
@@ -1,12 +1,10 @@
 from agency_swarm.agents import Agent
 from agency_swarm.tools import BaseTool
 from pydantic import Field
-import os
-from openai import OpenAI
-
-# Instantiate the OpenAI client
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY")  # The API key is retrieved from the environment variable
+from typing import Optional
+import uuid
+from .util import (
+    JOB_ID_PATTERN, GenerationJournal, generate_ebook, get_artifact_store, iter_ebook_chapters, stream_ebook_chapters
 )
 
 class EbookContentGenerator(BaseTool):
@@ -34,40 +32,80 @@ class EbookContentGenerator(BaseTool):
     tone: str = Field(
         ..., description="The desired tone (e.g., 'serious', 'humorous', 'inspirational')."
     )
+    max_concurrency: int = Field(
+        8, description="The maximum number of paragraph requests sent to the API at the same time."
+    )
+    batch_sections: bool = Field(
+        False, description="Whether to request all paragraphs of a section in a single API call."
+    )
+    use_cache: bool = Field(
+        True, description="Whether to reuse previously generated paragraphs from the local completion cache."
+    )
+    hedge_requests: bool = Field(
+        False, description="Whether to send a duplicate request when a paragraph takes much longer than usual."
+    )
+    job_id: Optional[str] = Field(
+        None, pattern=JOB_ID_PATTERN, description="Identifier of a resumable generation job. Paragraphs finished by an earlier run of the same job are reused."
+    )
 
     def run(self):
         """
         The implementation of the run method, where the tool's main functionality is executed.
-        This method generates the ebook content based on the provided parameters.
+        This method generates the ebook content based on the provided parameters,
+        requesting all paragraphs concurrently. The text is put in the artifact store under
+        the job's manifest and only its handle and a summary are returned.
+        """
+        book = self.build_book()
+        store = get_artifact_store()
+        job_id = self.job_id or uuid.uuid4().hex
+        handle = store.attach(job_id, "content", store.put_text(book.to_text()))
+        return f"Ebook content generated: {handle}\nJob ID: {job_id}\n{book.summary()}"
+
+    def build_book(self, on_chapter=None):
         """
-        ebook_content = f"Title: {self.topic}\n\n"
-        
-        for chapter_num in range(1, self.chapters + 1):
-            ebook_content += f"Chapter {chapter_num}: {self.topic} - Part {chapter_num}\n\n"
-            
-            for section_num in range(1, self.sections_per_chapter + 1):
-                ebook_content += f"Section {chapter_num}.{section_num}: {self.topic} - Section {section_num}\n\n"
-                
-                for paragraph_num in range(1, self.paragraphs_per_section + 1):
-                    prompt = (
-                        f"Write a {self.writing_style} and {self.tone} paragraph about {self.topic} "
-                        f"for Chapter {chapter_num}, Section {section_num}, Paragraph {paragraph_num}."
-                    )
-                    
-                    # Generate text using the OpenAI chat completion API
-                    response = client.chat.completions.create(
-                        model="gpt-4",  # You can adjust the model as needed
-                        messages=[
-                            {"role": "system", "content": "You are a helpful assistant."},
-                            {"role": "user", "content": prompt}
-                        ],
-                        max_tokens=150,
-                        temperature=0.7
-                    )
-                    generated_text = response.choices[0].message.content.strip()
-                    ebook_content += f"{generated_text}\n\n"
-        
-        return ebook_content
+        Generates the ebook content as a structured Book document. `on_chapter` is called
+        with each chapter, in order, as soon as it is complete.
+        """
+        return generate_ebook(**self._generation_options(), on_chapter=on_chapter)
+
+    def iter_chapters(self, prefetch_chapters=1):
+        """
+        Streams the ebook chapter by chapter, yielding each chapter in order as soon as it is
+        generated. At most `prefetch_chapters` chapters are generated ahead of the consumer.
+        """
+        return iter_ebook_chapters(**self._generation_options(), prefetch_chapters=prefetch_chapters)
+
+    def stream_chapters(self, prefetch_chapters=1):
+        """
+        Async iterator version of `iter_chapters` for callers running in an event loop.
+        """
+        return stream_ebook_chapters(**self._generation_options(), prefetch_chapters=prefetch_chapters)
+
+    def _generation_options(self):
+        return dict(
+            topic=self.topic,
+            chapters=self.chapters,
+            sections_per_chapter=self.sections_per_chapter,
+            paragraphs_per_section=self.paragraphs_per_section,
+            writing_style=self.writing_style,
+            tone=self.tone,
+            max_concurrency=self.max_concurrency,
+            batch_sections=self.batch_sections,
+            use_cache=self.use_cache,
+            journal=GenerationJournal(self.job_id, parameters=self.job_parameters()) if self.job_id else None,
+            hedge_requests=self.hedge_requests
+        )
+
+    def job_parameters(self):
+        """Returns the parameters that decide the text, which a resumed job must keep."""
+        return dict(
+            topic=self.topic,
+            chapters=self.chapters,
+            sections_per_chapter=self.sections_per_chapter,
+            paragraphs_per_section=self.paragraphs_per_section,
+            writing_style=self.writing_style,
+            tone=self.tone
+        )
 
 
 class EbookGenerationAgent(Agent):
@@ -98,6 +136,4 @@ if __name__ == "__main__":
         writing_style="formal",
         tone="inspirational"
     )
-    content = tool.run()
-    print("Ebook content generated:")
-    print(content)
+    print(tool.run())
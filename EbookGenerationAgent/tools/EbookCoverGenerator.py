@@ -1,25 +1,27 @@
 from agency_swarm.agents import Agent  # Import the Agent class
 from agency_swarm.tools import BaseTool
 from pydantic import Field
-import requests
-import os
+from typing import Optional
+import uuid
+from .util import JOB_ID_PATTERN, get_artifact_store, get_cover_store, get_http_session
 
 class EbookCoverGenerator(BaseTool):
     """
     This tool generates an ebook cover image using a prompt.
-    It fetches the generated image and saves it locally under a specified directory.
+    It fetches the generated image and keeps it in the artifact store under the ebook job.
     """
     
     prompt: str = Field(
         ..., description="A text description of the desired ebook cover image."
     )
-    output_directory: str = Field(
-        "EbookAutomationAgency/EbookGenerationAgent/files", description="Directory to save the generated cover image."
+    job_id: Optional[str] = Field(
+        None, pattern=JOB_ID_PATTERN, description="Identifier of the ebook job the cover belongs to. A new job is created when omitted."
     )
     
     def run(self):
         """
-        Generates an ebook cover image based on the provided prompt and saves it locally.
+        Generates an ebook cover image based on the provided prompt and attaches it to the
+        job's manifest in the artifact store.
         """
         # Simulate image generation (replace this part with actual API call to generate an image)
         api_url = "https://api.example.com/v1/images/generate"  # Placeholder API URL
@@ -33,28 +35,27 @@ class EbookCoverGenerator(BaseTool):
             "size": "1024x1024"
         }
 
-        # Example of how to call an image generation API (DALL-E or similar)
-        response = requests.post(api_url, headers=headers, json=data)
+        store = get_cover_store()
+        key = store.key(api_url=api_url, **data)
 
-        if response.status_code == 200:
+        # Identical requests reuse the stored image instead of generating a new one
+        cached_path = store.get(key)
+        if cached_path is None:
+            # Example of how to call an image generation API (DALL-E or similar)
+            response = get_http_session().post(api_url, headers=headers, json=data)
+
+            if response.status_code != 200:
+                return f"Failed to generate ebook cover: {response.status_code} - {response.text}"
             image_url = response.json().get("data", [])[0].get("url")
-            image_response = requests.get(image_url)
-            if image_response.status_code == 200:
-                # Ensure the output directory exists
-                os.makedirs(self.output_directory, exist_ok=True)
+            try:
+                cached_path = store.put_url(key, image_url)
+            except Exception as e:
+                return f"Failed to download the generated image: {str(e)}"
 
-                # Define the path to save the image
-                image_path = os.path.join(self.output_directory, "cover_image.jpg")
-                
-                # Save the image locally
-                with open(image_path, "wb") as img_file:
-                    img_file.write(image_response.content)
-                
-                return f"Cover image generated and saved to: {image_path}"
-            else:
-                return f"Failed to download the generated image: {image_response.status_code} - {image_response.text}"
-        else:
-            return f"Failed to generate ebook cover: {response.status_code} - {response.text}"
+        artifacts = get_artifact_store()
+        job_id = self.job_id or uuid.uuid4().hex
+        handle = artifacts.attach(job_id, "cover", artifacts.put_file(cached_path))
+        return f"Cover image generated and saved to: {artifacts.path(handle)} ({handle})\nJob ID: {job_id}"
 
 class EbookCoverGenerationAgent(Agent):
     def __init__(self, **kwargs):
@@ -0,0 +1,47 @@
+from agency_swarm.tools import BaseTool
+from pydantic import Field
+from typing import List, Literal, Optional
+import uuid
+from .util import JOB_ID_PATTERN, Book, export_ebook, get_artifact_store, resolve_content, resolve_cover_image
+
+class EbookExporter(BaseTool):
+    """
+    This tool exports the ebook in several formats at once: PDF, EPUB 3 and a static HTML
+    edition. The content is parsed and the cover is prepared once for all formats, and the
+    editions are written concurrently and kept in the artifact store under the ebook job.
+    """
+
+    content: str = Field(
+        ..., description="Artifact handle returned by EbookContentGenerator, or the content of the ebook itself, including chapters, sections, and paragraphs."
+    )
+    cover_image_url: str = Field(
+        ..., description="URL, local file path or artifact handle of the cover image to be included in the ebook."
+    )
+    job_id: Optional[str] = Field(
+        None, pattern=JOB_ID_PATTERN, description="Identifier of the ebook job the editions belong to. A new job is created when omitted."
+    )
+    formats: List[Literal["pdf", "epub", "html"]] = Field(
+        ["pdf", "epub", "html"], description="The formats to export."
+    )
+    parallel_render: bool = Field(
+        True, description="Whether to lay out PDF chapters in parallel worker processes."
+    )
+
+    def run(self):
+        """
+        Exports the ebook in every requested format, attaches each edition to the job's
+        manifest under its format name and returns their paths and handles.
+        """
+        book = Book.from_text(resolve_content(self.content))
+        cover_image_filename = resolve_cover_image(self.cover_image_url)
+        store = get_artifact_store()
+        outputs = {output_format: store.temp_path(f".{output_format}") for output_format in self.formats}
+        job_id = self.job_id or uuid.uuid4().hex
+        results = export_ebook(book, cover_image_filename, outputs, parallel=self.parallel_render, job_id=job_id)
+        handles = {
+            output_format: store.attach(job_id, output_format, store.put_file(path, move=True))
+            for output_format, path in results.items()
+        }
+        return "Ebook exported: " + ", ".join(
+            f"{output_format}: {store.path(handle)} ({handle})" for output_format, handle in handles.items()
+        ) + f"\nJob ID: {job_id}"
@@ -1,7 +1,9 @@
 from agency_swarm.agents import Agent  # Import the Agent class
 from agency_swarm.tools import BaseTool
 from pydantic import Field
-from fpdf import FPDF  # Importing FPDF for PDF generation
+from typing import Optional
+import uuid
+from .util import JOB_ID_PATTERN, Book, get_artifact_store, is_handle, render_ebook_pdf
 
 class EbookPDFGenerator(BaseTool):
     """
@@ -10,37 +12,42 @@ class EbookPDFGenerator(BaseTool):
     """
 
     content: str = Field(
-        ..., description="The content of the ebook, including chapters, sections, and paragraphs."
+        ..., description="Artifact handle of the ebook content, or the content itself, including chapters, sections, and paragraphs."
     )
     cover_image_path: str = Field(
-        ..., description="Path to the cover image file to be included in the ebook."
+        ..., description="Artifact handle or path of the cover image file to be included in the ebook."
     )
-    output_filename: str = Field(
-        "ebook.pdf", description="The name of the output PDF file."
+    job_id: Optional[str] = Field(
+        None, pattern=JOB_ID_PATTERN, description="Identifier of the ebook job the PDF belongs to. A new job is created when omitted."
+    )
+    parallel_render: bool = Field(
+        True, description="Whether to lay out chapters in parallel worker processes. Disable to lay out the whole book in a single process."
+    )
+    use_cache: bool = Field(
+        True, description="Whether to reuse the layout of chapters that did not change since an earlier render. Requires parallel_render."
+    )
+    table_of_contents: bool = Field(
+        True, description="Whether to add a table of contents page before the first chapter. Chapters and sections always get PDF bookmarks."
+    )
+    optimize_for_web: bool = Field(
+        True, description="Whether to compact and linearize the PDF (fast web view) so its first page can be shown while it downloads. The result reports the size before and after."
     )
 
     def run(self):
         """
-        Generates a PDF ebook with the provided content and cover image.
+        Generates a PDF ebook with the provided content and cover image and attaches it to
+        the job's manifest in the artifact store.
         """
-        pdf = FPDF()
-        pdf.set_auto_page_break(auto=True, margin=15)
-
-        # Add cover page
-        pdf.add_page()
-        pdf.image(self.cover_image_path, x=10, y=10, w=190)  # Adjust image size and position as needed
-
-        # Add ebook content
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-        for line in self.content.split("\n"):
-            pdf.multi_cell(0, 10, line)
-        
-        # Save the PDF
-        pdf_file_path = self.output_filename
-        pdf.output(pdf_file_path)
-        
-        return f"PDF ebook generated successfully: {pdf_file_path}"
+        store = get_artifact_store()
+        content = store.read_text(self.content) if is_handle(self.content) else self.content
+        cover_image_path = store.path(self.cover_image_path) if is_handle(self.cover_image_path) else self.cover_image_path
+        pdf_path = store.temp_path(".pdf")
+        result = render_ebook_pdf(Book.from_text(content), cover_image_path, pdf_path,
+                                  parallel=self.parallel_render, use_cache=self.use_cache,
+                                  toc=self.table_of_contents, optimize=self.optimize_for_web)
+        job_id = self.job_id or uuid.uuid4().hex
+        handle = store.attach(job_id, "pdf", store.put_file(pdf_path, move=True))
+        return result.replace(pdf_path, store.path(handle)) + f"\nArtifact: {handle}\nJob ID: {job_id}"
 
 class EbookPDFGenerationAgent(Agent):
     def __init__(self, **kwargs):
@@ -5,7 +5,7 @@ from pydantic import Field, field_validator
 from agency_swarm.tools import BaseTool
 from agency_swarm import get_openai_client
 from agency_swarm.util.validators import llm_validator
-from .util import format_file_deps
+from .util import INTERACTIVE, format_file_deps, get_completion_cache, get_scheduler
 
 class FileWriter(BaseTool):
     """
@@ -44,7 +44,8 @@ class FileWriter(BaseTool):
         one_call_at_a_time = True
 
     def run(self):
-        client = get_openai_client()
+        # Retries are handled by the shared request scheduler
+        client = get_openai_client().with_options(max_retries=0)
 
         file_dependencies = format_file_deps(self.file_dependencies)
         library_dependencies = ", ".join(self.library_dependencies)
@@ -76,18 +77,27 @@ class FileWriter(BaseTool):
 
         # API call without unsupported parameters
         try:
-            response = client.chat.completions.create(
+            request = dict(
                 model="gpt-4",  # Ensure using a valid model
                 messages=[{"role": "system", "content": "You are a helpful assistant."}, {"role": "user", "content": message}],
                 max_tokens=1500,  # Adjust token limit as needed
                 temperature=0.5,
             )
-            content = response.choices[0].message.content
-
-            # Extract code from the response
-            code = self.extract_code(content)
+            cache = get_completion_cache()
+            content = cache.get(request)
+            code = self.extract_code(content) if content else ""
             if not code:
-                raise ValueError("Error: Could not find the code block in the response.")
+                response = get_scheduler().call(client.chat.completions.with_raw_response.create, request, INTERACTIVE)
+                content = response.choices[0].message.content
+                if content is None:
+                    raise ValueError("The model returned no content.")
+
+                # Extract code from the response
+                code = self.extract_code(content)
+                if not code:
+                    raise ValueError("Error: Could not find the code block in the response.")
+                # Only usable answers are cached, so a retry of the same request asks the API again
+                cache.put(request, content)
 
             # Write the code to the specified file path
             self.write_to_file(code)
@@ -0,0 +1,26 @@
+from .artifact_store import (
+    JOB_ID_PATTERN, ArtifactStore, get_artifact_store, is_handle, resolve_content, validate_job_id
+)
+from .async_completions import complete_all, parse_all, run_sync
+from .completion_cache import CompletionCache, get_completion_cache
+from .cover_image import DEFAULT_THUMBNAIL_WIDTHS, prepare_cover_image
+from .cover_store import CoverStore, download_file, get_cover_store, get_http_session, resolve_cover_image
+from .document import Book, Chapter, Paragraph, Section
+from .ebook_content import (
+    SectionParagraphs, generate_ebook, generate_ebook_content, iter_ebook_chapters, paragraph_request,
+    section_request, stream_ebook_chapters, supports_structured_outputs
+)
+from .export import EXPORT_FORMATS, book_identifier, book_metadata, export_ebook, write_epub, write_html
+from .fast_layout import WidthTable, fast_layout_available, fast_multi_cell, get_width_table
+from .fonts import TESTED_FPDF_VERSIONS, FontSet, fpdf_internals_supported, get_font_set
+from .format_file_deps import format_file_deps
+from .fragment_cache import FragmentCache, get_fragment_cache
+from .generation_journal import GenerationJournal
+from .hedging import RequestHedger, get_hedger
+from .pdf_layout import (
+    LAYOUT_SETTINGS, EbookPDFWriter, ParallelPDFWriter, get_render_pool, layout_settings, layout_toc,
+    render_chapter_fragment, render_chapters_pdf, render_ebook_pdf
+)
+from .pdf_optimize import describe_optimization, optimize_pdf
+from .pipeline import Pipeline
+from .rate_limiter import BULK, INTERACTIVE, RequestScheduler, get_scheduler
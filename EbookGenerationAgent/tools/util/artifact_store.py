@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+DEFAULT_ARTIFACT_DIR = "artifacts"
+HANDLE_PREFIX = "artifact://"
+# Job ids become file and directory names, so they are restricted to characters that cannot leave them
+JOB_ID_PATTERN = r"^[A-Za-z0-9_-]+$"
+
+
+def is_handle(value):
+    return isinstance(value, str) and value.startswith(HANDLE_PREFIX)
+
+
+def validate_job_id(job_id):
+    """Returns `job_id`, or raises ValueError unless it only has letters, digits, '_' and '-'."""
+    if not isinstance(job_id, str) or not re.fullmatch(JOB_ID_PATTERN, job_id):
+        raise ValueError(f"Invalid job ID {job_id!r}: only letters, digits, '_' and '-' are allowed")
+    return job_id
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for the files produced by ebook jobs.
+
+    Every artifact is a blob named after the SHA-256 of its bytes, so identical content
+    is stored once no matter how many jobs produce it. Jobs refer to blobs through
+    handles (`artifact://<sha256><ext>`) recorded by name in a per-job manifest, which
+    lets any number of jobs run side by side without sharing file names. Blobs that
+    no manifest refers to any more are removed by `gc()`.
+    """
+
+    def __init__(self, root=DEFAULT_ARTIFACT_DIR):
+        self.root = root
+        self.blobs_dir = os.path.join(root, "blobs")
+        self.manifests_dir = os.path.join(root, "manifests")
+        self.tmp_dir = os.path.join(root, "tmp")
+        for directory in (self.blobs_dir, self.manifests_dir, self.tmp_dir):
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def path(self, handle):
+        """Returns the local file path of the blob behind `handle`."""
+        if not is_handle(handle):
+            raise ValueError(f"Not an artifact handle: {handle}")
+        name = handle[len(HANDLE_PREFIX):]
+        return os.path.join(self.blobs_dir, name[:2], name)
+
+    def temp_path(self, suffix=""):
+        """Returns a unique path in the store's scratch area, e.g. for writers that need a file name."""
+        fd, path = tempfile.mkstemp(dir=self.tmp_dir, suffix=suffix)
+        os.close(fd)
+        return path
+
+    def put_bytes(self, data, ext=""):
+        digest = hashlib.sha256(data).hexdigest()
+        handle = f"{HANDLE_PREFIX}{digest}{ext}"
+        path = self.path(handle)
+        if os.path.exists(path):
+            self._touch(path)
+        else:
+            tmp_path = self.temp_path()
+            with open(tmp_path, "wb") as tmp_file:
+                tmp_file.write(data)
+            self._commit(tmp_path, path)
+        return handle
+
+    def put_text(self, text, ext=".txt"):
+        return self.put_bytes(text.encode("utf-8"), ext)
+
+    def put_file(self, file_path, ext=None, move=False):
+        """
+        Adds an existing file to the store and returns its handle. With `move`, the file
+        is moved into the store instead of copied (it must be on the same filesystem).
+        """
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as source:
+            for chunk in iter(lambda: source.read(1 << 20), b""):
+                digest.update(chunk)
+        if ext is None:
+            ext = os.path.splitext(file_path)[1]
+        handle = f"{HANDLE_PREFIX}{digest.hexdigest()}{ext}"
+        path = self.path(handle)
+        if os.path.exists(path):
+            self._touch(path)
+            if move:
+                os.unlink(file_path)
+        elif move:
+            self._commit(file_path, path)
+        else:
+            tmp_path = self.temp_path()
+            shutil.copyfile(file_path, tmp_path)
+            self._commit(tmp_path, path)
+        return handle
+
+    def _touch(self, path):
+        # A deduplicated blob counts as fresh so gc() does not collect it before it is attached
+        os.utime(path)
+
+    def _commit(self, tmp_path, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+    def read_bytes(self, handle):
+        with open(self.path(handle), "rb") as blob:
+            return blob.read()
+
+    def read_text(self, handle):
+        return self.read_bytes(handle).decode("utf-8")
+
+    def _manifest_path(self, job_id):
+        return os.path.join(self.manifests_dir, f"{validate_job_id(job_id)}.json")
+
+    def manifest(self, job_id):
+        """Returns the artifacts of a job as {name: {"handle", "size", "time"}}."""
+        try:
+            with open(self._manifest_path(job_id), "r") as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            return {}
+
+    def attach(self, job_id, name, handle):
+        """Records `handle` under `name` in the job's manifest and returns the handle."""
+        with self._lock:
+            manifest = self.manifest(job_id)
+            manifest[name] = {"handle": handle, "size": os.path.getsize(self.path(handle)), "time": time.time()}
+            tmp_path = self.temp_path()
+            with open(tmp_path, "w") as manifest_file:
+                json.dump(manifest, manifest_file, indent=2)
+            os.replace(tmp_path, self._manifest_path(job_id))
+        return handle
+
+    def get(self, job_id, name):
+        """Returns the handle stored under `name` for the job, or None."""
+        entry = self.manifest(job_id).get(name)
+        if entry and os.path.exists(self.path(entry["handle"])):
+            return entry["handle"]
+        return None
+
+    def delete_job(self, job_id):
+        """Forgets a job's manifest. Its blobs are reclaimed by the next `gc()` unless shared."""
+        with self._lock:
+            try:
+                os.unlink(self._manifest_path(job_id))
+            except FileNotFoundError:
+                pass
+
+    def gc(self, grace_period=3600):
+        """
+        Deletes blobs not referenced by any manifest and stale scratch files. Files younger
+        than `grace_period` seconds are kept so artifacts of running jobs that are not
+        attached yet survive. Returns the number of files and bytes removed.
+        """
+        with self._lock:
+            referenced = set()
+            for manifest_name in os.listdir(self.manifests_dir):
+                if manifest_name.endswith(".json"):
+                    job_id = manifest_name[:-len(".json")]
+                    referenced.update(entry["handle"] for entry in self.manifest(job_id).values())
+            referenced_paths = {self.path(handle) for handle in referenced}
+
+            cutoff = time.time() - grace_period
+            removed, freed = 0, 0
+            candidates = [os.path.join(self.tmp_dir, name) for name in os.listdir(self.tmp_dir)]
+            for shard in os.listdir(self.blobs_dir):
+                shard_dir = os.path.join(self.blobs_dir, shard)
+                candidates.extend(os.path.join(shard_dir, name) for name in os.listdir(shard_dir))
+            for path in candidates:
+                if path in referenced_paths:
+                    continue
+                try:
+                    stat = os.stat(path)
+                    if stat.st_mtime > cutoff:
+                        continue
+                    os.unlink(path)
+                except FileNotFoundError:
+                    # Moved into the store or collected by another process meanwhile
+                    continue
+                removed += 1
+                freed += stat.st_size
+            return {"removed": removed, "bytes": freed}
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_artifact_store():
+    """Returns the artifact store located by the EBOOK_ARTIFACT_DIR environment variable."""
+    root = os.getenv("EBOOK_ARTIFACT_DIR", DEFAULT_ARTIFACT_DIR)
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = ArtifactStore(root)
+        return _stores[root]
+
+
+def resolve_content(content):
+    """Returns the ebook text behind an artifact handle, or `content` itself."""
+    return get_artifact_store().read_text(content) if is_handle(content) else content
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Delete artifacts that no ebook job refers to.")
+    parser.add_argument("--grace-period", type=int, default=3600,
+                        help="Keep unreferenced files younger than this many seconds.")
+    args = parser.parse_args()
+    collected = get_artifact_store().gc(grace_period=args.grace_period)
+    print(f"Removed {collected['removed']} artifacts ({collected['bytes']} bytes)")
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import os
+import threading
+
+from openai import AsyncOpenAI, BadRequestError, ContentFilterFinishReasonError, LengthFinishReasonError
+from pydantic import ValidationError
+from .rate_limiter import BULK, get_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+def run_sync(coro):
+    """
+    Runs a coroutine to completion from synchronous code. Tools are invoked from
+    plain `run()` methods, which may already be executing inside an event loop
+    (e.g. the gradio demo), so in that case the coroutine runs on a helper thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result = {}
+
+    def runner():
+        try:
+            result["value"] = asyncio.run(coro)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=runner)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+async def _send(hedger, send, request):
+    scheduler = get_scheduler()
+    if hedger is None:
+        return await scheduler.call_async(send, request, BULK)
+
+    # The hedge takes its own slot and tokens from the scheduler, and none is sent while it backs off from rate limits
+    return await hedger.run(
+        lambda: scheduler.call_async(send, request, BULK),
+        can_hedge=lambda: not scheduler.backing_off()
+    )
+
+
+async def _complete(client, semaphore, request, cache, hedger):
+    if cache is not None:
+        cached = cache.get(request)
+        if cached is not None:
+            return cached
+    async with semaphore:
+        response = await _send(hedger, client.chat.completions.with_raw_response.create, request)
+    text = response.choices[0].message.content.strip()
+    if cache is not None:
+        cache.put(request, text)
+    return text
+
+
+async def _notify(index, coro, on_result):
+    result = await coro
+    if on_result is not None:
+        on_result(index, result)
+    return result
+
+
+async def _parse(client, semaphore, request, response_format, cache, hedger, accept):
+    if cache is not None:
+        cached = cache.get(request, response_format)
+        if cached is not None:
+            parsed = response_format.model_validate_json(cached)
+            if accept is None or accept(parsed):
+                return parsed
+    async with semaphore:
+        try:
+            completion = await _send(
+                hedger,
+                client.beta.chat.completions.with_raw_response.parse,
+                {**request, "response_format": response_format}
+            )
+        except (LengthFinishReasonError, ContentFilterFinishReasonError, ValidationError):
+            return None
+        except BadRequestError as e:
+            # E.g. a model without structured outputs; the caller falls back like for any unusable answer
+            logger.warning("Structured-output request rejected: %s", e)
+            return None
+    message = completion.choices[0].message
+    if message.refusal:
+        return None
+    # Answers the caller rejects are not cached, so a re-run asks the API again instead of falling back
+    if cache is not None and (accept is None or accept(message.parsed)):
+        cache.put(request, message.parsed.model_dump_json(), response_format)
+    return message.parsed
+
+
+def new_async_client():
+    """Returns a client for the bulk requests of `complete_all` and `parse_all`."""
+    # Retries are handled by the shared request scheduler
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+
+async def _gather(requests, send, max_concurrency, client, semaphore):
+    owns_client = client is None
+    if owns_client:
+        client = new_async_client()
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    try:
+        return await asyncio.gather(*(
+            send(client, semaphore, index, request) for index, request in enumerate(requests)
+        ))
+    finally:
+        if owns_client:
+            await client.close()
+
+
+async def complete_all(requests, max_concurrency=8, cache=None, on_result=None, hedger=None, client=None,
+                       semaphore=None):
+    """
+    Sends every chat completion request concurrently, with at most `max_concurrency`
+    requests in flight, and returns the generated texts in the order of `requests`.
+    Requests found in `cache` are answered without calling the API. `on_result` is
+    called with the index and text of each request as soon as it completes. Slow
+    requests are hedged when a `hedger` is given. Callers that issue several batches at
+    once pass their own `client` and `semaphore` so the limit holds across all of them;
+    a client passed in is left open.
+    """
+    return await _gather(
+        requests,
+        lambda client, semaphore, index, request: _notify(
+            index, _complete(client, semaphore, request, cache, hedger), on_result
+        ),
+        max_concurrency, client, semaphore
+    )
+
+
+async def parse_all(requests, response_format, max_concurrency=8, cache=None, on_result=None, hedger=None,
+                    accept=None, client=None, semaphore=None):
+    """
+    Sends every structured-output request concurrently and returns the parsed
+    `response_format` instances in request order. Requests that are rejected by the API
+    (400) or whose output is refused, truncated or does not match the schema yield None
+    so the caller can fall back.
+    `on_result` is called with the index and parsed result of each request as soon
+    as it completes. Slow requests are hedged when a `hedger` is given. When `accept`
+    is given, only results it returns True for are written to or read from `cache`.
+    `client` and `semaphore` are shared as in `complete_all`.
+    """
+    return await _gather(
+        requests,
+        lambda client, semaphore, index, request: _notify(
+            index, _parse(client, semaphore, request, response_format, cache, hedger, accept), on_result
+        ),
+        max_concurrency, client, semaphore
+    )
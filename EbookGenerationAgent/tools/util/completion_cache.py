@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "ebook_ai", "completions.sqlite3")
+
+
+class CompletionCache:
+    """
+    Content-addressed cache of chat completion results stored in SQLite.
+
+    Entries are keyed on the model, messages, temperature, max_tokens and response
+    format of a request. Entries older than `ttl` seconds are ignored and purged, and
+    the least recently used entries are evicted once the cache holds more than
+    `max_entries` entries or `max_bytes` bytes of completion text.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=50000, max_bytes=256 * 1024 * 1024,
+                 ttl=30 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        dir_path = os.path.dirname(path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(request, response_format=None):
+        """Returns the cache key of a chat completion request."""
+        payload = {
+            "model": request.get("model"),
+            "messages": request.get("messages"),
+            "temperature": request.get("temperature"),
+            "max_tokens": request.get("max_tokens"),
+            "response_format": response_format.__name__ if response_format else None,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, request, response_format=None):
+        """Returns the cached completion text for `request`, or None on a miss."""
+        key = self.key(request, response_format)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM completions WHERE key = ? AND created >= ?", (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE completions SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, request, value, response_format=None):
+        """Stores the completion text for `request` and evicts entries over the limits."""
+        key = self.key(request, response_format)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM completions WHERE created < ?", (now - self.ttl,))
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        # Walk entries from least to most recently used until both limits are satisfied
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM completions ORDER BY accessed"):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            count -= 1
+            total -= size
+        self._conn.executemany("DELETE FROM completions WHERE key = ?", evicted)
+
+    def stats(self):
+        """Returns hit/miss counters and the current size of the cache."""
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": total}
+
+    def clear(self):
+        """Removes every cached completion."""
+        with self._lock:
+            self._conn.execute("DELETE FROM completions")
+            self._conn.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_completion_cache():
+    """
+    Returns the process-wide completion cache. The database location can be changed
+    with the COMPLETION_CACHE_PATH environment variable.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CompletionCache(os.getenv("COMPLETION_CACHE_PATH", DEFAULT_CACHE_PATH))
+        return _cache
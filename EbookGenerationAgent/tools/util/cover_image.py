@@ -0,0 +1,74 @@
+import hashlib
+import os
+import tempfile
+
+from PIL import Image
+
+MM_PER_INCH = 25.4
+DEFAULT_THUMBNAIL_WIDTHS = (600, 300)
+DEFAULT_DERIVED_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ebook_ai", "cover_images")
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _derived_path(directory, source_digest, tag):
+    return os.path.join(directory, source_digest[:2], f"{source_digest}.{tag}.jpg")
+
+
+def _save_jpeg(image, path, quality):
+    # Written under a temporary name and renamed, so concurrent jobs never read a partial image.
+    # No exif/icc data is passed to save(), which strips the metadata of the original
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            image.save(tmp_file, format="JPEG", quality=quality, optimize=True, progressive=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _resized(image, width):
+    if image.width <= width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def prepare_cover_image(source_path, width_mm=190, dpi=150, quality=85, thumbnail_widths=()):
+    """
+    Derives the images needed from a cover in a single decode of the original: a JPEG
+    downscaled to `dpi` at the printed width of `width_mm` and recompressed at `quality`,
+    and one JPEG thumbnail per width in `thumbnail_widths` (for the landing page).
+
+    Derived images are cached in the directory set by the EBOOK_COVER_IMAGE_DIR
+    environment variable, keyed by the SHA-256 of the original and their settings, so
+    they are never stale and never stored next to the original. Returns
+    {"pdf": path, "thumbnails": {width: path}}.
+    """
+    directory = os.getenv("EBOOK_COVER_IMAGE_DIR", DEFAULT_DERIVED_DIR)
+    source_digest = _file_digest(source_path)
+    pdf_width = max(1, round(width_mm / MM_PER_INCH * dpi))
+    pdf_path = _derived_path(directory, source_digest, f"{dpi}dpi-{pdf_width}w-q{quality}")
+    thumbnail_paths = {
+        width: _derived_path(directory, source_digest, f"thumb-{width}w-q{quality}") for width in thumbnail_widths
+    }
+
+    missing = [path for path in (pdf_path, *thumbnail_paths.values()) if not os.path.exists(path)]
+    if missing:
+        with Image.open(source_path) as original:
+            image = original.convert("RGB")
+        if pdf_path in missing:
+            _save_jpeg(_resized(image, pdf_width), pdf_path, quality)
+        for width, path in thumbnail_paths.items():
+            if path in missing:
+                _save_jpeg(_resized(image, width), path, quality)
+
+    return {"pdf": pdf_path, "thumbnails": thumbnail_paths}
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .artifact_store import get_artifact_store, is_handle
+
+DEFAULT_COVER_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ebook_ai", "covers")
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """Returns a process-wide requests session with a connection pool for API calls and downloads."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def download_file(url, path, chunk_size=1 << 16, timeout=60):
+    """
+    Streams `url` to `path` in chunks through the pooled session. The file is written
+    under a temporary name and renamed when complete, so `path` is never partial.
+    """
+    dir_path = os.path.dirname(path) or "."
+    os.makedirs(dir_path, exist_ok=True)
+    with get_http_session().get(url, stream=True, timeout=timeout) as response:
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch the cover image: {response.status_code} - {response.text}")
+        fd, tmp_path = tempfile.mkstemp(dir=dir_path, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    tmp_file.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    return path
+
+
+class CoverStore:
+    """
+    Local store of generated cover images keyed by their generation parameters.
+
+    The image bytes are kept rather than the generated URL, which expires, so a cover
+    generated once with a given prompt, quality, size and style is reused by every later
+    run without another image generation call.
+    """
+
+    def __init__(self, directory=DEFAULT_COVER_DIR):
+        self.directory = directory
+
+    @staticmethod
+    def key(**params):
+        """Returns the store key for a set of generation parameters."""
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.png")
+
+    def get(self, key):
+        """Returns the local path of the stored image, or None if it has not been stored."""
+        path = self.path(key)
+        return path if os.path.exists(path) else None
+
+    def put_url(self, key, url):
+        """Downloads the image at `url` into the store and returns its local path."""
+        path = download_file(url, self.path(key))
+        with open(f"{path}.json", "w") as meta_file:
+            json.dump({"url": url}, meta_file)
+        return path
+
+    def fetch(self, url):
+        """Returns a local copy of the image at `url`, downloading it only the first time."""
+        key = self.key(url=url)
+        return self.get(key) or self.put_url(key, url)
+
+
+def get_cover_store():
+    """Returns the cover store located by the EBOOK_COVER_DIR environment variable."""
+    return CoverStore(os.getenv("EBOOK_COVER_DIR", DEFAULT_COVER_DIR))
+
+
+def resolve_cover_image(cover_image_url):
+    """Returns a local path for a cover given as an artifact handle, local path or URL."""
+    # Use a stored or local cover image as is, otherwise fetch it from the provided URL
+    if is_handle(cover_image_url):
+        return get_artifact_store().path(cover_image_url)
+    if os.path.isfile(cover_image_url):
+        return cover_image_url
+    try:
+        return get_cover_store().fetch(cover_image_url)
+    except Exception as e:
+        raise Exception(f"Error occurred while fetching the cover image: {str(e)}")
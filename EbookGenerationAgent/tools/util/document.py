@@ -0,0 +1,98 @@
+from dataclasses import dataclass, field
+from typing import List
+
+
+@dataclass(slots=True)
+class Paragraph:
+    text: str
+
+
+@dataclass(slots=True)
+class Section:
+    heading: str
+    paragraphs: List[Paragraph] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class Chapter:
+    heading: str
+    paragraphs: List[Paragraph] = field(default_factory=list)
+    sections: List[Section] = field(default_factory=list)
+
+    def to_text(self):
+        """Serializes the chapter to the plain text format produced by EbookContentGenerator."""
+        parts = [f"{self.heading}\n\n"]
+        parts.extend(f"{paragraph.text}\n\n" for paragraph in self.paragraphs)
+        for section in self.sections:
+            parts.append(f"{section.heading}\n\n")
+            parts.extend(f"{paragraph.text}\n\n" for paragraph in section.paragraphs)
+        return "".join(parts)
+
+
+@dataclass(slots=True)
+class Book:
+    """
+    Structured ebook document: a title, optional front matter paragraphs and a list of
+    chapters, each holding optional introduction paragraphs and a list of sections.
+    """
+    title: str
+    paragraphs: List[Paragraph] = field(default_factory=list)
+    chapters: List[Chapter] = field(default_factory=list)
+
+    def to_text(self):
+        """Serializes the book to the plain text format produced by EbookContentGenerator."""
+        parts = [f"Title: {self.title}\n\n"]
+        parts.extend(f"{paragraph.text}\n\n" for paragraph in self.paragraphs)
+        parts.extend(chapter.to_text() for chapter in self.chapters)
+        return "".join(parts)
+
+    def summary(self, max_headings=10):
+        """
+        Returns a short description of the book (counts and chapter headings) for places
+        such as tool outputs where the full text would be too long.
+        """
+        sections = sum(len(chapter.sections) for chapter in self.chapters)
+        paragraphs = [*self.paragraphs]
+        for chapter in self.chapters:
+            paragraphs.extend(chapter.paragraphs)
+            for section in chapter.sections:
+                paragraphs.extend(section.paragraphs)
+        words = sum(len(paragraph.text.split()) for paragraph in paragraphs)
+        headings = [chapter.heading for chapter in self.chapters[:max_headings]]
+        if len(self.chapters) > max_headings:
+            headings.append(f"... and {len(self.chapters) - max_headings} more")
+        return (f"'{self.title}': {len(self.chapters)} chapters, {sections} sections, "
+                f"{len(paragraphs)} paragraphs, {words} words. Chapters: {'; '.join(headings)}")
+
+    @classmethod
+    def from_text(cls, content):
+        """
+        Parses ebook text into a Book. The first line is the title, lines starting with
+        'Chapter' or 'Section' are headings and every other non-empty line is a paragraph.
+        """
+        lines = content.split("\n")
+        title = lines[0].strip()
+        if title.startswith("Title:"):
+            title = title[len("Title:"):].strip()
+        book = cls(title=title)
+
+        target = book.paragraphs
+        chapter = None
+        for line in lines[1:]:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("Chapter"):
+                chapter = Chapter(heading=line)
+                book.chapters.append(chapter)
+                target = chapter.paragraphs
+            elif line.startswith("Section"):
+                if chapter is None:
+                    chapter = Chapter(heading="")
+                    book.chapters.append(chapter)
+                section = Section(heading=line)
+                chapter.sections.append(section)
+                target = section.paragraphs
+            else:
+                target.append(Paragraph(text=line))
+        return book
@@ -0,0 +1,369 @@
+import asyncio
+import contextlib
+import logging
+import queue
+import threading
+from collections import deque
+from typing import List
+from pydantic import BaseModel, Field
+from .async_completions import complete_all, new_async_client, parse_all, run_sync
+from .completion_cache import get_completion_cache
+from .document import Book, Chapter, Paragraph, Section
+from .hedging import get_hedger
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gpt-4"
+# Batched section requests use `json_schema` structured outputs, which gpt-4 does not support
+DEFAULT_BATCH_MODEL = "gpt-4o"
+STRUCTURED_OUTPUT_MODELS = ("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4")
+
+
+def supports_structured_outputs(model):
+    """Returns whether a model family accepts `json_schema` response formats."""
+    return model.removeprefix("ft:").startswith(STRUCTURED_OUTPUT_MODELS)
+
+
+class SectionParagraphs(BaseModel):
+    paragraphs: List[str] = Field(..., description="The paragraphs of the section, in reading order.")
+
+
+def paragraph_request(topic, writing_style, tone, chapter_num, section_num, paragraph_num, model=DEFAULT_MODEL):
+    """Builds the chat completion request for a single ebook paragraph."""
+    prompt = (
+        f"Write a {writing_style} and {tone} paragraph about {topic} "
+        f"for Chapter {chapter_num}, Section {section_num}, Paragraph {paragraph_num}."
+    )
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": 150,
+        "temperature": 0.7,
+    }
+
+
+def section_request(topic, writing_style, tone, chapter_num, section_num, paragraphs_per_section,
+                    model=DEFAULT_BATCH_MODEL):
+    """
+    Builds a structured-output request for all paragraphs of one section. The model must
+    support structured outputs (see `supports_structured_outputs`).
+    """
+    prompt = (
+        f"Write {paragraphs_per_section} {writing_style} and {tone} paragraphs about {topic} "
+        f"for Chapter {chapter_num}, Section {section_num}. Each paragraph should be about 100 words "
+        f"and build on the previous one."
+    )
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": 150 * paragraphs_per_section + 50,
+        "temperature": 0.7,
+    }
+
+
+def _chapter_positions(chapter_num, sections_per_chapter, paragraphs_per_section):
+    return [
+        (chapter_num, section_num, paragraph_num)
+        for section_num in range(1, sections_per_chapter + 1)
+        for paragraph_num in range(1, paragraphs_per_section + 1)
+    ]
+
+
+class _ContentGenerator:
+    """Generation settings of one ebook plus the shared cache, hedger and journal it uses."""
+
+    def __init__(self, topic, chapters, sections_per_chapter, paragraphs_per_section, writing_style, tone,
+                 max_concurrency, batch_sections, use_cache, journal, hedge_requests, model, batch_model):
+        if batch_sections and not supports_structured_outputs(batch_model):
+            raise ValueError(f"Batched sections need a model with structured outputs, {batch_model} has none")
+        self.topic = topic
+        self.chapters = chapters
+        self.sections_per_chapter = sections_per_chapter
+        self.paragraphs_per_section = paragraphs_per_section
+        self.writing_style = writing_style
+        self.tone = tone
+        self.model = model
+        self.batch_model = batch_model
+        self.max_concurrency = max_concurrency
+        self.batch_sections = batch_sections
+        self.cache = get_completion_cache() if use_cache else None
+        self.hedger = get_hedger() if hedge_requests else None
+        self.journal = journal
+        self.client = None
+        self.semaphore = None
+        self._lock = threading.Lock()
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        """
+        Opens the client and the concurrency limit shared by every request of the run, so
+        chapters generated side by side never have more than `max_concurrency` in flight.
+        """
+        self.client = new_async_client()
+        self.semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+        try:
+            yield
+        finally:
+            await self.client.close()
+            self.client = self.semaphore = None
+
+    def journaled(self):
+        """Returns the paragraphs a previous run of the job already generated."""
+        return self.journal.paragraphs() if self.journal is not None else {}
+
+    def record(self, position, text, sink):
+        with self._lock:
+            if self.journal is not None:
+                self.journal.record_paragraph(position, text)
+            sink(position, text)
+
+    async def generate(self, positions, sink):
+        """Generates the paragraphs at `positions`, passing each to `sink` as soon as it is ready."""
+        if self.batch_sections:
+            await self._generate_batched(positions, sink)
+        else:
+            await self._generate_single(positions, sink)
+
+    async def _generate_single(self, positions, sink):
+        requests = [
+            paragraph_request(self.topic, self.writing_style, self.tone, *position, model=self.model)
+            for position in positions
+        ]
+
+        def on_result(index, text):
+            self.record(positions[index], text, sink)
+
+        await complete_all(requests, self.max_concurrency, self.cache, on_result, self.hedger, self.client,
+                           self.semaphore)
+
+    async def _generate_batched(self, positions, sink):
+        paragraphs_per_section = self.paragraphs_per_section
+        missing_by_section = {}
+        for chapter_num, section_num, paragraph_num in positions:
+            missing_by_section.setdefault((chapter_num, section_num), []).append(paragraph_num)
+
+        # Only sections with no finished paragraphs are batched, partially finished ones are completed one by one
+        sections = [
+            section for section, missing in missing_by_section.items() if len(missing) == paragraphs_per_section
+        ]
+        single_positions = [
+            (*section, paragraph_num)
+            for section, missing in missing_by_section.items() if len(missing) != paragraphs_per_section
+            for paragraph_num in missing
+        ]
+        requests = [
+            section_request(self.topic, self.writing_style, self.tone, *section, paragraphs_per_section,
+                            model=self.batch_model)
+            for section in sections
+        ]
+
+        def accept(result):
+            return len(result.paragraphs) == paragraphs_per_section
+
+        def on_result(index, result):
+            if result is not None and accept(result):
+                for paragraph_num, text in enumerate(result.paragraphs, start=1):
+                    self.record((*sections[index], paragraph_num), text.strip(), sink)
+
+        parsed = await parse_all(requests, SectionParagraphs, self.max_concurrency, self.cache, on_result,
+                                 self.hedger, accept, self.client, self.semaphore)
+
+        for section, result in zip(sections, parsed):
+            if result is None or not accept(result):
+                # The batched answer could not be used, so the section is regenerated paragraph by paragraph
+                single_positions.extend(
+                    (*section, paragraph_num) for paragraph_num in range(1, paragraphs_per_section + 1)
+                )
+
+        if single_positions:
+            await self._generate_single(single_positions, sink)
+
+    def build_chapter(self, chapter_num, paragraphs):
+        topic = self.topic
+        return Chapter(heading=f"Chapter {chapter_num}: {topic} - Part {chapter_num}", sections=[
+            Section(heading=f"Section {chapter_num}.{section_num}: {topic} - Section {section_num}", paragraphs=[
+                Paragraph(text=paragraphs[(chapter_num, section_num, paragraph_num)])
+                for paragraph_num in range(1, self.paragraphs_per_section + 1)
+            ])
+            for section_num in range(1, self.sections_per_chapter + 1)
+        ])
+
+    def log_stats(self):
+        if self.cache is not None:
+            logger.info("Completion cache stats: %s", self.cache.stats())
+        if self.hedger is not None:
+            logger.info("Request latency and hedging: %s", self.hedger.metrics())
+
+
+class _ChapterAssembler:
+    """Collects finished paragraphs and emits every chapter, in order, once all of its paragraphs are in."""
+
+    def __init__(self, generator, on_chapter):
+        self.generator = generator
+        self.on_chapter = on_chapter
+        self.paragraphs = {}
+        self.remaining = {
+            chapter_num: generator.sections_per_chapter * generator.paragraphs_per_section
+            for chapter_num in range(1, generator.chapters + 1)
+        }
+        self.next_chapter = 1
+        self.built = []
+
+    def add(self, position, text):
+        if position in self.paragraphs:
+            return
+        self.paragraphs[position] = text
+        self.remaining[position[0]] -= 1
+        while self.next_chapter <= self.generator.chapters and self.remaining[self.next_chapter] == 0:
+            chapter = self.generator.build_chapter(self.next_chapter, self.paragraphs)
+            self.built.append(chapter)
+            if self.on_chapter is not None:
+                self.on_chapter(chapter)
+            self.next_chapter += 1
+
+
+def generate_ebook(topic, chapters, sections_per_chapter, paragraphs_per_section,
+                   writing_style, tone, max_concurrency=8, batch_sections=False, use_cache=True,
+                   journal=None, hedge_requests=False, on_chapter=None, model=DEFAULT_MODEL,
+                   batch_model=DEFAULT_BATCH_MODEL):
+    """
+    Generates the full ebook as a Book. All paragraph prompts are sent concurrently and
+    the results are reassembled in chapter/section/paragraph order. With `batch_sections`,
+    each section is requested in a single structured-output call instead of one call
+    per paragraph. With `use_cache`, completions are read from and written to the
+    on-disk completion cache so re-runs of the same book do not call the API again.
+    When a `journal` is given, every finished paragraph is recorded in it and
+    paragraphs already present in it are not generated again. With `hedge_requests`,
+    requests that run slower than the recent p95 latency are duplicated and the first
+    answer wins. `on_chapter` is called with each Chapter, in order, as soon as all of
+    its paragraphs are available. Single paragraph requests use `model` and batched
+    sections `batch_model`, which must support structured outputs; sections whose
+    batched request is rejected or unusable are generated paragraph by paragraph.
+    """
+    generator = _ContentGenerator(topic, chapters, sections_per_chapter, paragraphs_per_section, writing_style,
+                                  tone, max_concurrency, batch_sections, use_cache, journal, hedge_requests, model,
+                                  batch_model)
+    assembler = _ChapterAssembler(generator, on_chapter)
+
+    journaled = generator.journaled()
+    positions = [
+        position
+        for chapter_num in range(1, chapters + 1)
+        for position in _chapter_positions(chapter_num, sections_per_chapter, paragraphs_per_section)
+    ]
+    missing = [position for position in positions if position not in journaled]
+    if len(missing) < len(positions):
+        logger.info("Resuming from journal: %d of %d paragraphs already generated",
+                    len(positions) - len(missing), len(positions))
+        for position in positions:
+            if position in journaled:
+                assembler.add(position, journaled[position])
+
+    async def generate(positions):
+        async with generator.connection():
+            await generator.generate(positions, assembler.add)
+
+    if missing:
+        run_sync(generate(missing))
+    generator.log_stats()
+
+    return Book(title=topic, chapters=assembler.built)
+
+
+async def stream_ebook_chapters(topic, chapters, sections_per_chapter, paragraphs_per_section,
+                                writing_style, tone, max_concurrency=8, batch_sections=False, use_cache=True,
+                                journal=None, hedge_requests=False, prefetch_chapters=1, model=DEFAULT_MODEL,
+                                batch_model=DEFAULT_BATCH_MODEL):
+    """
+    Asynchronously yields the chapters of the ebook in order. Only the next chapter and up
+    to `prefetch_chapters` chapters after it are generated at any time, and a chapter's
+    paragraphs are released once it has been yielded, so memory stays bounded by a few
+    chapters regardless of the length of the book. The other options behave as in
+    `generate_ebook`.
+    """
+    generator = _ContentGenerator(topic, chapters, sections_per_chapter, paragraphs_per_section, writing_style,
+                                  tone, max_concurrency, batch_sections, use_cache, journal, hedge_requests, model,
+                                  batch_model)
+    journaled = generator.journaled()
+
+    async def generate_chapter(chapter_num):
+        positions = _chapter_positions(chapter_num, sections_per_chapter, paragraphs_per_section)
+        paragraphs = {position: journaled.pop(position) for position in positions if position in journaled}
+        missing = [position for position in positions if position not in paragraphs]
+        if missing:
+            await generator.generate(missing, paragraphs.__setitem__)
+        return generator.build_chapter(chapter_num, paragraphs)
+
+    pending = deque()
+    next_chapter = 1
+    async with generator.connection():
+        try:
+            while pending or next_chapter <= chapters:
+                while next_chapter <= chapters and len(pending) <= prefetch_chapters:
+                    pending.append(asyncio.ensure_future(generate_chapter(next_chapter)))
+                    next_chapter += 1
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+            # Prefetched chapters stop using the shared client before it is closed
+            await asyncio.gather(*pending, return_exceptions=True)
+            generator.log_stats()
+
+
+def iter_ebook_chapters(*args, **kwargs):
+    """
+    Synchronous counterpart of `stream_ebook_chapters`. Chapters are generated on a
+    background event loop and handed over one at a time as they are consumed.
+    """
+    handoff = queue.Queue(maxsize=1)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                handoff.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    async def produce():
+        stream = stream_ebook_chapters(*args, **kwargs)
+        try:
+            async for chapter in stream:
+                # Waiting for the consumer happens off the loop, so prefetched chapters keep generating meanwhile
+                if not await asyncio.to_thread(put, chapter):
+                    break
+        finally:
+            await stream.aclose()
+
+    def run():
+        try:
+            asyncio.run(produce())
+            put(done)
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while (item := handoff.get()) is not done:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def generate_ebook_content(*args, **kwargs):
+    """Generates the full ebook with `generate_ebook` and returns it in the plain text format."""
+    return generate_ebook(*args, **kwargs).to_text()
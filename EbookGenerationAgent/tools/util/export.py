@@ -0,0 +1,202 @@
+import base64
+import html
+import os
+import uuid
+import zipfile
+from datetime import datetime, timezone
+
+from .cover_image import prepare_cover_image
+from .pdf_layout import render_ebook_pdf
+from .pipeline import Pipeline
+
+EXPORT_FORMATS = ("pdf", "epub", "html")
+
+# Namespace of the name-based UUIDs that identify editions of a book
+BOOK_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "urn:ebook-ai:book")
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+STYLESHEET = """body { font-family: sans-serif; line-height: 1.5; margin: 0 auto; max-width: 40em; padding: 0 1em; }
+h1.title { text-align: center; margin-top: 3em; }
+img.cover { display: block; max-width: 100%; margin: 0 auto; }
+"""
+
+
+def book_identifier(book, job_id=None):
+    """
+    Returns a stable `urn:uuid:` identifier derived from the ebook job, or from the title
+    without one, so a re-export after the text was edited keeps the EPUB identifier and
+    readers treat it as an update of the same book.
+    """
+    name = f"job:{job_id}" if job_id else f"title:{book.title}"
+    return f"urn:uuid:{uuid.uuid5(BOOK_ID_NAMESPACE, name)}"
+
+
+def book_metadata(book, identifier=None, language="en", job_id=None):
+    """Returns the metadata shared by every edition of a book."""
+    return {
+        "title": book.title,
+        "language": language,
+        "identifier": identifier or book_identifier(book, job_id),
+        "modified": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+    }
+
+
+def _paragraphs_html(paragraphs):
+    return "".join(f"<p>{html.escape(paragraph.text)}</p>\n" for paragraph in paragraphs)
+
+
+def _chapter_html(chapter, number, heading_level=1):
+    """Renders a chapter as HTML with anchors `chapter-N` and `chapter-N-section-M`."""
+    parts = [f'<h{heading_level} id="chapter-{number}">{html.escape(chapter.heading)}</h{heading_level}>\n']
+    parts.append(_paragraphs_html(chapter.paragraphs))
+    for index, section in enumerate(chapter.sections, start=1):
+        parts.append(f'<h{heading_level + 1} id="chapter-{number}-section-{index}">'
+                     f'{html.escape(section.heading)}</h{heading_level + 1}>\n')
+        parts.append(_paragraphs_html(section.paragraphs))
+    return "".join(parts)
+
+
+def _toc_html(book, href):
+    """Renders the nested table of contents list; `href(number)` gives the document of a chapter."""
+    items = []
+    for number, chapter in enumerate(book.chapters, start=1):
+        sections = "".join(
+            f'<li><a href="{href(number)}#chapter-{number}-section-{index}">{html.escape(section.heading)}</a></li>'
+            for index, section in enumerate(chapter.sections, start=1)
+        )
+        items.append(f'<li><a href="{href(number)}#chapter-{number}">{html.escape(chapter.heading)}</a>'
+                     + (f"<ol>{sections}</ol>" if sections else "") + "</li>\n")
+    return f"<ol>\n{''.join(items)}</ol>\n"
+
+
+def _xhtml(title, body, language):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n'
+        f'<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" '
+        f'lang="{language}" xml:lang="{language}">\n'
+        f'<head><meta charset="UTF-8"/><title>{html.escape(title)}</title>'
+        f'<link rel="stylesheet" type="text/css" href="style.css"/></head>\n'
+        f"<body>\n{body}</body>\n</html>\n"
+    )
+
+
+def write_html(book, cover_image_path, output_filename, metadata):
+    """Writes a self-contained single page HTML edition with the cover embedded."""
+    with open(cover_image_path, "rb") as cover_file:
+        cover = base64.b64encode(cover_file.read()).decode("ascii")
+    body = [
+        f'<img class="cover" src="data:image/jpeg;base64,{cover}" alt="Cover"/>\n',
+        f'<h1 class="title">{html.escape(book.title)}</h1>\n',
+        _paragraphs_html(book.paragraphs),
+        f'<nav><h2>Contents</h2>\n{_toc_html(book, lambda number: "")}</nav>\n',
+    ]
+    body.extend(
+        _chapter_html(chapter, number, heading_level=2) for number, chapter in enumerate(book.chapters, start=1)
+    )
+    document = (
+        f'<!DOCTYPE html>\n<html lang="{metadata["language"]}">\n'
+        f'<head><meta charset="UTF-8"/><title>{html.escape(book.title)}</title>'
+        f'<meta name="viewport" content="width=device-width, initial-scale=1"/>'
+        f"<style>{STYLESHEET}</style></head>\n"
+        f"<body>\n{''.join(body)}</body>\n</html>\n"
+    )
+    with open(output_filename, "w", encoding="utf-8") as html_file:
+        html_file.write(document)
+    return output_filename
+
+
+def write_epub(book, cover_image_path, output_filename, metadata):
+    """Writes an EPUB 3 edition: a cover page, a title page and one XHTML document per chapter."""
+    language = metadata["language"]
+    chapter_href = "chapter-{}.xhtml".format
+    documents = [
+        ("cover", "cover.xhtml", _xhtml(book.title, '<img class="cover" src="cover.jpg" alt="Cover"/>\n', language)),
+        ("title", "title.xhtml", _xhtml(
+            book.title, f'<h1 class="title">{html.escape(book.title)}</h1>\n{_paragraphs_html(book.paragraphs)}',
+            language
+        )),
+    ]
+    for number, chapter in enumerate(book.chapters, start=1):
+        document = _xhtml(chapter.heading, _chapter_html(chapter, number), language)
+        documents.append((f"chapter-{number}", chapter_href(number), document))
+    toc = _toc_html(book, chapter_href)
+    nav = _xhtml(book.title, f'<nav epub:type="toc" id="toc"><h1>Contents</h1>\n{toc}</nav>\n', language)
+
+    manifest = [
+        '<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>',
+        '<item id="style" href="style.css" media-type="text/css"/>',
+        '<item id="cover-image" href="cover.jpg" media-type="image/jpeg" properties="cover-image"/>',
+    ]
+    manifest.extend(
+        f'<item id="{item_id}" href="{href}" media-type="application/xhtml+xml"/>' for item_id, href, _ in documents
+    )
+    spine = "".join(f'<itemref idref="{item_id}"/>' for item_id, _, _ in documents)
+    package = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">\n'
+        '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+        f'<dc:identifier id="book-id">{html.escape(metadata["identifier"])}</dc:identifier>\n'
+        f'<dc:title>{html.escape(metadata["title"])}</dc:title>\n'
+        f'<dc:language>{language}</dc:language>\n'
+        f'<meta property="dcterms:modified">{metadata["modified"]}</meta>\n'
+        '<meta name="cover" content="cover-image"/>\n'
+        f"</metadata>\n<manifest>\n{chr(10).join(manifest)}\n</manifest>\n"
+        f"<spine>{spine}</spine>\n</package>\n"
+    )
+
+    tmp_path = f"{output_filename}.part"
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as epub:
+        # The mimetype entry must come first and be stored uncompressed
+        epub.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        epub.writestr("META-INF/container.xml", CONTAINER_XML)
+        epub.writestr("OEBPS/content.opf", package)
+        epub.writestr("OEBPS/nav.xhtml", nav)
+        epub.writestr("OEBPS/style.css", STYLESHEET)
+        # JPEG data does not compress any further
+        epub.write(cover_image_path, "OEBPS/cover.jpg", compress_type=zipfile.ZIP_STORED)
+        for _, href, document in documents:
+            epub.writestr(f"OEBPS/{href}", document)
+    os.replace(tmp_path, output_filename)
+    return output_filename
+
+
+def export_ebook(book, cover_image_path, outputs, metadata=None, parallel=False, use_cache=True, optimize=True,
+                 job_id=None):
+    """
+    Exports a parsed Book to several formats at once. `outputs` maps formats from
+    EXPORT_FORMATS to output file names. The cover is prepared once and the same image
+    is embedded in every edition, and the writers run concurrently. With `optimize`, the
+    PDF edition is compacted and linearized for fast web view. The book identifier is
+    derived from `job_id` unless `metadata` is given. Returns {format: output file name}.
+    """
+    unknown = set(outputs) - set(EXPORT_FORMATS)
+    if unknown:
+        raise ValueError(f"Unsupported export formats: {', '.join(sorted(unknown))}")
+    metadata = metadata or book_metadata(book, job_id=job_id)
+
+    def prepare_cover():
+        return prepare_cover_image(cover_image_path)["pdf"]
+
+    def write_pdf(cover):
+        # The cover is already prepared, so the PDF writer embeds it as is
+        render_ebook_pdf(book, cover, outputs["pdf"], parallel=parallel, use_cache=use_cache, optimize=optimize,
+                         cover_dpi=None)
+        return outputs["pdf"]
+
+    writers = {
+        "pdf": write_pdf,
+        "epub": lambda cover: write_epub(book, cover, outputs["epub"], metadata),
+        "html": lambda cover: write_html(book, cover, outputs["html"], metadata),
+    }
+    pipeline = Pipeline().add("cover", prepare_cover)
+    for output_format in outputs:
+        pipeline.add(output_format, writers[output_format], depends_on=("cover",))
+    results = pipeline.run()
+    return {output_format: results[output_format] for output_format in outputs}
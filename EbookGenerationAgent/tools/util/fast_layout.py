@@ -0,0 +1,219 @@
+import logging
+import re
+import threading
+
+from fpdf import FPDF, FPDF_VERSION
+from fpdf.enums import Align, XPos, YPos
+
+try:
+    # Internals of fpdf2 that are not part of its public API
+    from fpdf.line_break import TextLine
+    from fpdf.util import FloatTolerance, Padding
+except ImportError:
+    TextLine = FloatTolerance = Padding = None
+
+from .fonts import SAMPLE_TEXT, FontSet, fpdf_internals_supported, get_font_set
+
+logger = logging.getLogger(__name__)
+
+# Characters with special line breaking rules in fpdf2 (other breaking spaces, tabs,
+# no-break and soft hyphens, explicit breaks). Paragraphs containing them are left to
+# multi_cell, as are words wider than a line.
+SPECIAL_CHARACTERS = re.compile("[\t\n\f\u00a0\u00ad\u200b\u2000-\u200a\u205f\u3000]")
+TOKENS = re.compile(r"[^ ]+| ")
+
+
+class WidthTable:
+    """
+    Character and word widths of one font in 1/1000 font units, as integers, so the
+    width of any run of text is an exact sum. Every word is measured once per process;
+    ebooks reuse a small vocabulary, so most lookups are a single dict hit.
+    """
+
+    def __init__(self, font):
+        cw = font.cw
+        self._char_width = (lambda char: cw[ord(char)]) if font.type == "TTF" else cw.__getitem__
+        self._chars = {}
+        self._words = {}
+
+    def char(self, char):
+        width = self._chars.get(char)
+        if width is None:
+            width = self._chars[char] = self._char_width(char)
+        return width
+
+    def word(self, word):
+        width = self._words.get(word)
+        if width is None:
+            width = self._words[word] = sum(self.char(char) for char in word)
+        return width
+
+
+_width_tables = {}
+_width_tables_lock = threading.Lock()
+
+
+def get_width_table(font):
+    """Returns the shared width table of an fpdf font, built on first use."""
+    key = (font.fontkey, str(getattr(font, "ttffile", "")))
+    with _width_tables_lock:
+        table = _width_tables.get(key)
+        if table is None:
+            table = _width_tables[key] = WidthTable(font)
+        return table
+
+
+def _wrap(text, table, to_width, max_width):
+    """
+    Breaks `text` into lines the way fpdf2's MultiLineBreak does in word wrap mode.
+    Returns (start, end, units, spaces, justified) per line, or None when a word has to be
+    split, which is left to multi_cell. Lines ended by wrapping are justified, the line
+    ending the paragraph is not.
+    """
+    greater_than = FloatTolerance.greater_than
+    space_width = table.char(" ")
+    lines = []
+    start, units, spaces, hint = 0, 0, 0, None
+
+    for match in TOKENS.finditer(text):
+        position = match.start()
+        if match.group() == " ":
+            if greater_than(to_width(units) + to_width(space_width), max_width):
+                # The overflowing space is dropped and the line ends before it
+                lines.append((start, position, units, spaces, True))
+                start, units, spaces, hint = position + 1, 0, 0, None
+                continue
+            hint = (position, units, spaces)
+            spaces += 1
+            units += space_width
+            continue
+
+        word = match.group()
+        while True:
+            word_units = table.word(word)
+            # Words well within the line skip the per-character check
+            if to_width(units + word_units) < max_width - 1e-6:
+                units += word_units
+                break
+            line_units = units
+            for char in word:
+                char_units = table.char(char)
+                if greater_than(to_width(line_units) + to_width(char_units), max_width):
+                    break
+                line_units += char_units
+            else:
+                units = line_units
+                break
+            if hint is None:
+                return None
+            # Break at the last space; the word starts the next line
+            lines.append((start, hint[0], hint[1], hint[2], True))
+            start, units, spaces, hint = hint[0] + 1, 0, 0, None
+
+    if units:
+        lines.append((start, len(text), units, spaces, False))
+    return lines
+
+
+_available = None
+_available_lock = threading.Lock()
+
+def fast_layout_available():
+    """
+    Returns whether fast_multi_cell can be used with the installed fpdf2. It relies on
+    fpdf2 internals, so it is only enabled for the releases in TESTED_FPDF_VERSIONS
+    (checked byte for byte with benchmarks/check_fast_layout.py), and once per process a
+    sample paragraph laid out both ways, in the core font and in the ebook's embedded
+    fonts, must produce the same page content.
+    """
+    global _available
+    with _available_lock:
+        if _available is None:
+            _available = _check_fast_layout()
+        return _available
+
+
+def _check_fast_layout():
+    if TextLine is None or not fpdf_internals_supported():
+        logger.warning("Fast paragraph layout is not supported with fpdf2 %s, using multi_cell", FPDF_VERSION)
+        return False
+    font_sets = [FontSet("Helvetica")]
+    ebook_fonts = get_font_set()
+    if not ebook_fonts.is_core:
+        font_sets.append(ebook_fonts)
+    for font_set in font_sets:
+        contents = []
+        try:
+            for layout in (_fast_multi_cell, lambda pdf, h, text: pdf.multi_cell(0, h, text)):
+                pdf = FPDF()
+                font_set.register(pdf)
+                pdf.add_page()
+                pdf.set_font(font_set.family, size=12)
+                layout(pdf, 10, SAMPLE_TEXT)
+                contents.append((bytes(pdf.pages[1].contents), pdf.x, pdf.y))
+        except (AttributeError, TypeError):
+            logger.warning("Fast paragraph layout failed with fpdf2 %s, using multi_cell", FPDF_VERSION,
+                           exc_info=True)
+            return False
+        if contents[0] != contents[1]:
+            logger.warning("Fast paragraph layout differs from multi_cell in %s with fpdf2 %s, using multi_cell",
+                           font_set.family, FPDF_VERSION)
+            return False
+    return True
+
+
+def fast_multi_cell(pdf, h, text):
+    """
+    Equivalent of `pdf.multi_cell(0, h, text)` with justified text, producing the same
+    output, that measures words through cached width tables instead of re-measuring
+    the line for every character. Text it cannot lay out identically, and any text when
+    the installed fpdf2 is not supported, is passed on to multi_cell.
+    """
+    if not fast_layout_available():
+        return pdf.multi_cell(0, h, text)
+    return _fast_multi_cell(pdf, h, text)
+
+
+def _fast_multi_cell(pdf, h, text):
+    if not text or SPECIAL_CHARACTERS.search(text) or pdf.text_shaping:
+        return pdf.multi_cell(0, h, text)
+    text = pdf.normalize_text(text).replace("\r", "")
+    fragments = pdf._preload_font_styles(text, False)
+    if len(fragments) != 1 or fragments[0].char_spacing or fragments[0].font_stretching != 100:
+        return pdf.multi_cell(0, h, text)
+    fragment = fragments[0]
+
+    w = pdf.w - pdf.r_margin - pdf.x
+    font_size_pt = fragment.font_size_pt
+    k = fragment.k
+
+    # Same arithmetic as Fragment.get_width, so comparisons round identically
+    def to_width(units):
+        return units * font_size_pt * 0.001 / k
+
+    lines = _wrap(text, get_width_table(fragment.font), to_width, w - 2 * pdf.c_margin)
+    if not lines:
+        return pdf.multi_cell(0, h, text)
+
+    no_padding = Padding(0, 0, 0, 0)
+    for index, (start, end, units, spaces, justified) in enumerate(lines):
+        is_last = index == len(lines) - 1
+        pdf._perform_page_break_if_need_be(h)
+        text_line = TextLine(
+            fragments=[fragment.clone(characters=text[start:end])],
+            text_width=to_width(units),
+            number_of_spaces=spaces,
+            align=Align.J if justified else Align.L,
+            height=fragment.font_size,
+            max_width=w,
+        )
+        pdf._render_styled_text_line(
+            text_line,
+            h=h,
+            new_x=XPos.RIGHT if is_last else XPos.LEFT,
+            new_y=YPos.NEXT,
+            border=0,
+            fill=False,
+            link=None,
+            padding=no_padding,
+        )
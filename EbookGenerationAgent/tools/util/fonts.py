@@ -0,0 +1,259 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FONT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ebook_ai", "fonts")
+
+# fpdf2 releases the code relying on fpdf2 internals (font copies here, fast_layout) was
+# checked against; with any other release only fpdf2's public API is used
+TESTED_FPDF_VERSIONS = ("2.8.",)
+
+SAMPLE_TEXT = (
+    "The quick brown fox jumps over the lazy dog, then keeps running across the wide open field "
+    "until the evening light fades behind the distant hills. " * 3
+).strip()
+
+# Unicode sans-serif families with a bold face, in order of preference
+FONT_CANDIDATES = [
+    ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"),
+    ("/usr/share/fonts/dejavu/DejaVuSans.ttf", "/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf"),
+    ("/usr/share/fonts/TTF/DejaVuSans.ttf", "/usr/share/fonts/TTF/DejaVuSans-Bold.ttf"),
+    ("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+     "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf"),
+    ("/System/Library/Fonts/Supplemental/Arial.ttf", "/System/Library/Fonts/Supplemental/Arial Bold.ttf"),
+    ("/Library/Fonts/Arial.ttf", "/Library/Fonts/Arial Bold.ttf"),
+    ("C:\\Windows\\Fonts\\arial.ttf", "C:\\Windows\\Fonts\\arialbd.ttf"),
+]
+
+# Closest Latin-1 spelling of characters GPT models commonly produce
+REPLACEMENTS = {
+    "\u2018": "'", "\u2019": "'", "\u201a": "'", "\u201b": "'",
+    "\u201c": '"', "\u201d": '"', "\u201e": '"', "\u201f": '"',
+    "\u2010": "-", "\u2011": "-", "\u2012": "-", "\u2013": "-", "\u2014": "--", "\u2015": "--", "\u2212": "-",
+    "\u2026": "...", "\u2022": "*", "\u2032": "'", "\u2033": '"',
+    "\u2009": " ", "\u200a": " ", "\u202f": " ", "\u200b": "", "\ufeff": "",
+}
+
+
+def fpdf_internals_supported():
+    """Returns whether the installed fpdf2 is one of TESTED_FPDF_VERSIONS."""
+    from fpdf import FPDF_VERSION
+
+    return FPDF_VERSION.startswith(TESTED_FPDF_VERSIONS)
+
+
+class FontSet:
+    """
+    The font family every ebook PDF is laid out with.
+
+    Unicode TTF fonts are registered in each document under `family`; fpdf2 embeds only
+    the glyphs that are used. Each font is parsed once per process and every document
+    gets a copy with its own glyph subset. Character widths and coverage are read from
+    the font once and persisted as JSON in the font cache, so later runs and worker
+    processes load them without parsing the font. Without TTF files the core Arial font is used, and text is
+    reduced to Latin-1 so it can always be encoded.
+    """
+
+    def __init__(self, family, files=None, cache_dir=DEFAULT_FONT_CACHE_DIR):
+        self.family = family
+        self.files = files or {}
+        self.cache_dir = cache_dir
+        self._metrics = {}
+        self._fonts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def is_core(self):
+        return not self.files
+
+    def identity(self):
+        """Describes the fonts, for cache keys of anything laid out with them."""
+        return {"family": self.family, "files": {style: self._file_key(path) for style, path in self.files.items()}}
+
+    @staticmethod
+    def _file_key(path):
+        stat = os.stat(path)
+        return hashlib.sha256(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+
+    def register(self, pdf):
+        """Adds the fonts to an FPDF document. Core fonts need no registration."""
+        for style, path in self.files.items():
+            font = self._copy_font(pdf, style, path)
+            if font is None:
+                pdf.add_font(self.family, style, path)
+            else:
+                pdf.fonts[font.fontkey] = font
+
+    def _copy_font(self, pdf, style, path):
+        """
+        Returns a fresh copy of the parsed font for `pdf`, or None when the font has to be
+        added with `add_font`.
+
+        fpdf2 parses the font and builds its width and glyph tables in `add_font`, which
+        costs about 0.1s per style and document. The parsed font is kept per process and
+        shallow-copied with the per-document state reset. Its font program is reopened
+        lazily from the bytes kept in memory, because fpdf2 subsets it in place on save.
+
+        This relies on fpdf2 internals, so it is only done with TESTED_FPDF_VERSIONS, and
+        only once a copy has laid out a sample paragraph exactly like the font added with
+        `add_font`.
+        """
+        from fpdf import FPDF, FPDF_VERSION
+
+        with self._lock:
+            if style not in self._fonts:
+                self._fonts[style] = None
+                if not fpdf_internals_supported():
+                    logger.warning("Font copies are not supported with fpdf2 %s, parsing fonts for every document",
+                                   FPDF_VERSION)
+                    return None
+                scratch = FPDF()
+                scratch.add_font(self.family, style, path)
+                prototype = scratch.fonts[f"{self.family.lower()}{style}"]
+                with open(path, "rb") as font_file:
+                    data = font_file.read()
+                # Colour and CID-keyed CFF fonts carry more document state than is reset below
+                if prototype.color_font is None and not prototype.is_cff and self._check_copy(
+                        style, path, prototype, data):
+                    self._fonts[style] = (prototype, data)
+            cached = self._fonts[style]
+        if cached is None:
+            return None
+        return self._new_copy(pdf, *cached)
+
+    @staticmethod
+    def _new_copy(pdf, prototype, data):
+        from fontTools import ttLib
+        from fpdf.fonts import SubsetMap
+
+        font = copy.copy(prototype)
+        font.i = len(pdf.fonts) + 1
+        font.ttfont = ttLib.TTFont(BytesIO(data), recalcTimestamp=False, lazy=True)
+        font.cw = copy.copy(prototype.cw)
+        font.missing_glyphs = []
+        font.biggest_size_pt = 0
+        font._hbfont = None
+        font.subset = SubsetMap(font)
+        return font
+
+    def _check_copy(self, style, path, prototype, data):
+        """Returns whether a copy of `prototype` lays out and subsets text like a font added with `add_font`."""
+        from fpdf import FPDF, FPDF_VERSION
+
+        results = []
+        try:
+            for copied in (False, True):
+                pdf = FPDF()
+                if copied:
+                    font = self._new_copy(pdf, prototype, data)
+                    pdf.fonts[font.fontkey] = font
+                else:
+                    pdf.add_font(self.family, style, path)
+                pdf.add_page()
+                pdf.set_font(self.family, style, size=12)
+                pdf.multi_cell(0, 10, SAMPLE_TEXT)
+                font = pdf.fonts[f"{self.family.lower()}{style}"]
+                results.append((bytes(pdf.pages[1].contents), list(font.subset.items())))
+        except (AttributeError, ImportError, TypeError):
+            logger.warning("Cannot copy fonts with fpdf2 %s, parsing them for every document", FPDF_VERSION,
+                           exc_info=True)
+            return False
+        if results[0] != results[1]:
+            logger.warning("Font copies differ from added fonts with fpdf2 %s, parsing fonts for every document",
+                           FPDF_VERSION)
+            return False
+        return True
+
+    def metrics(self, style=""):
+        """
+        Returns {"units_per_em", "default_width", "widths": {codepoint: advance width}} for a
+        style, from the persisted JSON when the font file has not changed.
+        """
+        with self._lock:
+            if style not in self._metrics:
+                self._metrics[style] = self._load_metrics(self.files.get(style) or self.files[""])
+            return self._metrics[style]
+
+    def _load_metrics(self, path):
+        cache_path = os.path.join(self.cache_dir, f"{self._file_key(path)}.json")
+        try:
+            with open(cache_path, "r") as cache_file:
+                metrics = json.load(cache_file)
+        except (FileNotFoundError, ValueError):
+            metrics = self._parse_metrics(path)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+            with os.fdopen(fd, "w") as tmp_file:
+                json.dump(metrics, tmp_file)
+            os.replace(tmp_path, cache_path)
+        metrics["widths"] = {int(codepoint): width for codepoint, width in metrics["widths"].items()}
+        return metrics
+
+    @staticmethod
+    def _parse_metrics(path):
+        from fontTools import ttLib
+
+        font = ttLib.TTFont(path, lazy=True)
+        advances = font["hmtx"].metrics
+        return {
+            "units_per_em": font["head"].unitsPerEm,
+            "default_width": advances[".notdef"][0] if ".notdef" in advances else 0,
+            "widths": {codepoint: advances[glyph][0] for codepoint, glyph in font.getBestCmap().items()},
+        }
+
+    def supported_codepoints(self):
+        """Returns a container of the codepoints the regular face can draw."""
+        return range(256) if self.is_core else self.metrics()["widths"]
+
+    def sanitize(self, text):
+        """
+        Replaces characters the fonts cannot draw with their closest Latin-1 spelling, or
+        '?' when there is none. Text the fonts fully support is returned unchanged.
+        """
+        supported = self.supported_codepoints()
+        if all(ord(char) in supported for char in text):
+            return text
+        return "".join(
+            char if ord(char) in supported else REPLACEMENTS.get(char, "?")
+            for char in text
+        )
+
+
+def find_font_files():
+    """
+    Returns {"": regular, "B": bold} from EBOOK_FONT_REGULAR and EBOOK_FONT_BOLD, or the
+    first installed candidate family, or None when no Unicode font is available.
+    """
+    regular = os.getenv("EBOOK_FONT_REGULAR")
+    if regular:
+        return {"": regular, "B": os.getenv("EBOOK_FONT_BOLD") or regular}
+    for regular, bold in FONT_CANDIDATES:
+        if os.path.isfile(regular):
+            return {"": regular, "B": bold if os.path.isfile(bold) else regular}
+    return None
+
+
+_font_set = None
+_font_set_lock = threading.Lock()
+
+
+def get_font_set():
+    """Returns the process-wide font set, falling back to the core Arial font without TTF files."""
+    global _font_set
+    with _font_set_lock:
+        if _font_set is None:
+            files = find_font_files()
+            cache_dir = os.getenv("EBOOK_FONT_CACHE_DIR", DEFAULT_FONT_CACHE_DIR)
+            if files:
+                _font_set = FontSet("EbookSans", files, cache_dir)
+            else:
+                logger.warning("No Unicode TTF font found, falling back to Arial with Latin-1 text")
+                _font_set = FontSet("Arial", cache_dir=cache_dir)
+        return _font_set
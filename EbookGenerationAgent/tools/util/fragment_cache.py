@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_FRAGMENT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ebook_ai", "fragments")
+
+
+class FragmentCache:
+    """
+    Local cache of laid out chapter PDF fragments keyed by the chapter's content and the
+    layout settings, so re-rendering an edited book only lays out the chapters that
+    changed. Each entry is the fragment PDF plus a JSON sidecar holding its outline.
+
+    The sidecar's mtime records when an entry was created and the PDF's mtime when it
+    was last used. Entries older than `ttl` seconds are ignored and purged, and the
+    least recently used entries are evicted once the cache holds more than
+    `max_entries` entries or `max_bytes` bytes.
+
+    Eviction scans the whole cache directory, so it runs on the first put and then only
+    every `evict_every` puts or once a sixteenth of `max_bytes` was written since the
+    last scan; the cache can exceed its limits by that much in between.
+    """
+
+    def __init__(self, directory=DEFAULT_FRAGMENT_DIR, max_entries=5000, max_bytes=512 * 1024 * 1024,
+                 ttl=30 * 24 * 3600, evict_every=64):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evict_every = evict_every
+        # None until the first put, which always scans, so limits lowered since the last run apply right away
+        self._puts_since_evict = None
+        self._bytes_since_evict = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(chapter, settings):
+        """Returns the cache key of a chapter laid out with the given layout settings."""
+        digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(chapter.to_text().encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.pdf")
+
+    def get(self, key):
+        """Returns the cached (pdf_bytes, outline) for `key`, or None."""
+        path = self._path(key)
+        try:
+            if os.path.getmtime(f"{path}.json") < time.time() - self.ttl:
+                return None
+            with open(f"{path}.json", "r") as outline_file:
+                outline = [tuple(entry) for entry in json.load(outline_file)]
+            with open(path, "rb") as fragment_file:
+                data = fragment_file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data, outline
+
+    def put(self, key, data, outline):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The PDF is written before its outline, and get() needs both, so readers never see half an entry
+        self._write(path, data)
+        self._write(f"{path}.json", json.dumps(outline).encode("utf-8"))
+        if self._evict_due(len(data)):
+            self._evict(time.time())
+
+    def _evict_due(self, size):
+        with self._lock:
+            if self._puts_since_evict is not None:
+                self._puts_since_evict += 1
+                self._bytes_since_evict += size
+                if self._puts_since_evict < self.evict_every and self._bytes_since_evict < self.max_bytes // 16:
+                    return False
+            self._puts_since_evict = 0
+            self._bytes_since_evict = 0
+            return True
+
+    def _entries(self):
+        """Returns (accessed, created, size, path) for every complete entry."""
+        entries = []
+        for shard in os.listdir(self.directory):
+            shard_dir = os.path.join(self.directory, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if not name.endswith(".pdf"):
+                    continue
+                path = os.path.join(shard_dir, name)
+                try:
+                    fragment, sidecar = os.stat(path), os.stat(f"{path}.json")
+                except FileNotFoundError:
+                    continue
+                entries.append((fragment.st_mtime, sidecar.st_mtime, fragment.st_size + sidecar.st_size, path))
+        return entries
+
+    def _evict(self, now):
+        entries = self._entries()
+        expired = [entry for entry in entries if entry[1] < now - self.ttl]
+        live = sorted(entry for entry in entries if entry[1] >= now - self.ttl)
+        count, total = len(live), sum(size for _, _, size, _ in live)
+
+        # Walk entries from least to most recently used until both limits are satisfied
+        evicted = expired
+        for entry in live:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            evicted.append(entry)
+            count -= 1
+            total -= entry[2]
+        for _, _, _, path in evicted:
+            # The sidecar goes first, so the entry stops counting as complete before its PDF is removed
+            for entry_path in (f"{path}.json", path):
+                try:
+                    os.unlink(entry_path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        """Returns the number of entries and the size of the cache in bytes."""
+        entries = self._entries()
+        return {"entries": len(entries), "bytes": sum(size for _, _, size, _ in entries)}
+
+    @staticmethod
+    def _write(path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_fragment_cache():
+    """
+    Returns the process-wide fragment cache, located by the EBOOK_FRAGMENT_DIR environment
+    variable. It is shared so the puts between eviction scans are counted across renders.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = FragmentCache(os.getenv("EBOOK_FRAGMENT_DIR", DEFAULT_FRAGMENT_DIR))
+        return _cache
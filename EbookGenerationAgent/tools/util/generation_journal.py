@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+import time
+
+from .artifact_store import validate_job_id
+
+DEFAULT_JOBS_DIR = os.getenv("EBOOK_JOBS_DIR", "jobs")
+
+
+class GenerationJournal:
+    """
+    Append-only JSONL journal of the completed units of an ebook generation job.
+
+    Every completed paragraph and the PDF step are appended as one JSON line and
+    flushed to disk immediately, so a crashed or interrupted job can be resumed by
+    skipping the units already present in the journal. The cover is resumed from the
+    job's artifact manifest instead.
+
+    The `parameters` the job was started with are recorded as the journal's first entry;
+    opening the journal again with different ones raises ValueError, so a resumed job
+    never mixes paragraphs written for another book.
+    """
+
+    def __init__(self, job_id, jobs_dir=DEFAULT_JOBS_DIR, parameters=None):
+        self.job_id = validate_job_id(job_id)
+        self.job_dir = os.path.join(jobs_dir, job_id)
+        self.path = os.path.join(self.job_dir, "journal.jsonl")
+        self._lock = threading.Lock()
+        os.makedirs(self.job_dir, exist_ok=True)
+        if parameters is not None:
+            self._check_parameters(parameters)
+
+    def _check_parameters(self, parameters):
+        # Compared after a JSON round trip, as they are read back from the journal
+        parameters = json.loads(json.dumps(parameters))
+        entry = self.entries("job").get(("job", "parameters"))
+        if entry is None:
+            self.record("job", "parameters", parameters=parameters)
+        elif entry["parameters"] != parameters:
+            changed = sorted(
+                name for name in set(parameters) | set(entry["parameters"])
+                if parameters.get(name) != entry["parameters"].get(name)
+            )
+            raise ValueError(
+                f"Job {self.job_id} was started with different parameters ({', '.join(changed)}); "
+                f"use a new job_id for a different book"
+            )
+
+    def record(self, kind, key, **data):
+        """Appends a completed unit of work to the journal."""
+        entry = {"kind": kind, "key": key, "time": time.time(), **data}
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as journal_file:
+                journal_file.write(line)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    def entries(self, kind=None):
+        """Returns the latest entry for every key, optionally filtered by kind."""
+        latest = {}
+        if not os.path.exists(self.path):
+            return latest
+        with open(self.path, "r", encoding="utf-8") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave a partially written last line behind
+                    continue
+                if kind is None or entry["kind"] == kind:
+                    latest[(entry["kind"], entry["key"])] = entry
+        return latest
+
+    def record_paragraph(self, position, text):
+        chapter_num, section_num, paragraph_num = position
+        self.record("paragraph", f"{chapter_num}.{section_num}.{paragraph_num}", text=text)
+
+    def paragraphs(self):
+        """Returns the journaled paragraphs keyed by (chapter, section, paragraph)."""
+        return {
+            tuple(int(part) for part in entry["key"].split(".")): entry["text"]
+            for entry in self.entries("paragraph").values()
+        }
+
+    def record_pdf(self, path, result):
+        self.record("pdf", "pdf", path=path, result=result)
+
+    def pdf(self):
+        """Returns the journaled PDF entry if the PDF file still exists."""
+        entry = self.entries("pdf").get(("pdf", "pdf"))
+        if entry and os.path.exists(entry["path"]):
+            return entry
+        return None
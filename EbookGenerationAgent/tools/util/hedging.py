@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+
+class RequestHedger:
+    """
+    Hedges slow requests to cut tail latency.
+
+    Latencies of recent requests are kept in a sliding window. When a request is still
+    running after the `percentile` latency of that window, an identical request is sent
+    and whichever finishes first wins while the other is cancelled. At most
+    `max_hedge_ratio` of all requests are hedged, which caps the extra API spend, and
+    no request is hedged while the `can_hedge` callback passed to `run` returns False.
+    """
+
+    def __init__(self, percentile=95, max_hedge_ratio=0.1, window=500, min_samples=20):
+        self.percentile = percentile
+        self.max_hedge_ratio = max_hedge_ratio
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def _percentile(self, samples, percentile):
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+    def _hedge_delay(self):
+        with self._lock:
+            self.requests += 1
+            if len(self.latencies) < self.min_samples:
+                return None
+            return self._percentile(self.latencies, self.percentile)
+
+    def _take_hedge(self):
+        with self._lock:
+            if self.hedges + 1 > self.max_hedge_ratio * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def observe(self, seconds):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    async def run(self, make_call, can_hedge=None):
+        """
+        Runs the coroutine produced by `make_call()`, hedging it with a second call if it
+        becomes slow and `can_hedge()` allows it.
+        """
+        delay = self._hedge_delay()
+        start = time.monotonic()
+        primary = asyncio.ensure_future(make_call())
+        if delay is not None:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if not done and (can_hedge is None or can_hedge()) and self._take_hedge():
+                hedge = asyncio.ensure_future(make_call())
+                try:
+                    result, winner = await self._first_success(primary, hedge)
+                finally:
+                    for task in (primary, hedge):
+                        task.cancel()
+                if winner is hedge:
+                    with self._lock:
+                        self.hedge_wins += 1
+                self.observe(time.monotonic() - start)
+                return result
+
+        result = await primary
+        self.observe(time.monotonic() - start)
+        return result
+
+    @staticmethod
+    async def _first_success(*tasks):
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), task
+                error = task.exception()
+        raise error
+
+    def metrics(self):
+        """Returns the hedge rate and the p50/p95/p99 latencies of recent requests in seconds."""
+        with self._lock:
+            samples = list(self.latencies)
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "hedge_rate": self.hedges / self.requests if self.requests else 0.0,
+                "p50": self._percentile(samples, 50),
+                "p95": self._percentile(samples, 95),
+                "p99": self._percentile(samples, 99),
+            }
+
+
+_hedger = None
+_hedger_lock = threading.Lock()
+
+
+def get_hedger():
+    """Returns the process-wide hedger shared by all paragraph generation runs."""
+    global _hedger
+    with _hedger_lock:
+        if _hedger is None:
+            _hedger = RequestHedger()
+        return _hedger
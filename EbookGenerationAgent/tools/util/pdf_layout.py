@@ -0,0 +1,427 @@
+import io
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos
+
+from .cover_image import prepare_cover_image
+from .fast_layout import fast_multi_cell
+from .fonts import get_font_set
+from .fragment_cache import get_fragment_cache
+from .pdf_optimize import describe_optimization, optimize_pdf
+
+logger = logging.getLogger(__name__)
+
+# Everything besides the fonts that affects how a chapter is laid out. Cached fragments
+# are keyed on it, so bump the version whenever the layout code changes.
+LAYOUT_SETTINGS = {"version": 3, "format": "A4", "page_break_margin": 15}
+
+
+def layout_settings():
+    """Returns the layout settings including the identity of the fonts in use."""
+    return {**LAYOUT_SETTINGS, "fonts": get_font_set().identity()}
+
+
+def new_pdf():
+    pdf = FPDF(format=LAYOUT_SETTINGS["format"])
+    pdf.set_auto_page_break(auto=True, margin=LAYOUT_SETTINGS["page_break_margin"])
+    get_font_set().register(pdf)
+    return pdf
+
+
+def layout_paragraphs(pdf, paragraphs):
+    fonts = get_font_set()
+    for paragraph in paragraphs:
+        fast_multi_cell(pdf, 10, fonts.sanitize(paragraph.text))
+        pdf.ln(10)
+
+
+def layout_chapter(pdf, chapter, new_page=True):
+    """
+    Lays out a chapter starting on a new page, or on the current one when `new_page`
+    is False, and adds its headings to the document outline. Returns the outline as a
+    list of (level, heading, page) entries, one for the chapter and one per section.
+    """
+    fonts = get_font_set()
+    if new_page:
+        pdf.add_page()
+    outline = [(0, chapter.heading, pdf.page)]
+    pdf.start_section(chapter.heading, level=0)
+    pdf.set_font(fonts.family, size=18, style='B')
+    pdf.cell(0, 10, fonts.sanitize(chapter.heading), ln=True)
+    pdf.set_font(fonts.family, size=12)
+    pdf.ln(10)
+    layout_paragraphs(pdf, chapter.paragraphs)
+
+    for section in chapter.sections:
+        pdf.set_font(fonts.family, size=14, style='B')
+        outline.append((1, section.heading, pdf.page))
+        pdf.start_section(section.heading, level=1)
+        pdf.cell(0, 10, fonts.sanitize(section.heading), ln=True)
+        pdf.set_font(fonts.family, size=12)
+        pdf.ln(10)
+        layout_paragraphs(pdf, section.paragraphs)
+    return outline
+
+
+def _fit_text(pdf, text, width):
+    """Shortens `text` with an ellipsis until it fits in `width` with the current font."""
+    if pdf.get_string_width(text) <= width:
+        return text
+    while text and pdf.get_string_width(text + "...") > width:
+        text = text[:-1]
+    return text.rstrip() + "..."
+
+
+def layout_toc(pdf, entries):
+    """
+    Lays out a table of contents at the current position from (level, heading,
+    page_label, link) entries; `link` may be None. Returns the (page, x, y, w, h) area
+    of every entry, so links can be added after merging documents.
+    """
+    fonts = get_font_set()
+    pdf.set_font(fonts.family, size=18, style='B')
+    pdf.cell(0, 10, "Contents", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.ln(5)
+    areas = []
+    for level, heading, label, link in entries:
+        pdf.set_font(fonts.family, size=12, style='' if level else 'B')
+        indent = 8 * level
+        label_width = pdf.get_string_width(label) + 2 * pdf.c_margin
+        heading_width = pdf.epw - indent - label_width
+        pdf.set_x(pdf.l_margin + indent)
+        pdf.cell(heading_width, 8, _fit_text(pdf, fonts.sanitize(heading), heading_width - 2 * pdf.c_margin),
+                 link=link or "")
+        areas.append((pdf.page, pdf.l_margin + indent, pdf.y, pdf.epw - indent, 8))
+        pdf.cell(label_width, 8, label, align="R", link=link or "", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    return areas
+
+
+def _render_toc_placeholder(pdf, outline):
+    """Fills the table of contents placeholder once the whole document is laid out."""
+    layout_toc(pdf, [
+        (section.level, section.name, pdf.pages[section.page_number].get_label(),
+         pdf.add_link(page=section.page_number))
+        for section in outline
+    ])
+
+
+class EbookPDFWriter:
+    """
+    Lays out an ebook incrementally. The first page is reserved for the cover, so
+    chapters can be laid out as soon as they are generated and the cover image is
+    drawn when the book is saved.
+
+    The cover is downscaled to `cover_dpi` at its printed width and recompressed as JPEG
+    at `cover_quality` before it is embedded. Set `cover_dpi` to None to embed it as is.
+
+    Chapters and sections get PDF bookmarks. With `toc`, a table of contents page is
+    reserved before the first chapter and filled in when the PDF is written, when every
+    heading's page is known, so the book is laid out only once. Front matter pages are
+    numbered i, ii, ... and chapter pages from 1, so the numbers in the table of contents
+    stay right when it takes more than one page.
+    """
+
+    def __init__(self, title, cover_dpi=150, cover_quality=85, toc=True):
+        self.cover_dpi = cover_dpi
+        self.cover_quality = cover_quality
+        self.toc = toc
+        self.chapters = 0
+        self.pdf = new_pdf()
+
+        # Reserve the cover page
+        self.pdf.add_page(label_style="r")
+
+        # Add title page
+        fonts = get_font_set()
+        self.pdf.add_page()
+        self.pdf.set_font(fonts.family, size=24)
+        self.pdf.multi_cell(0, 10, fonts.sanitize(title), align="C")
+        self.pdf.set_font(fonts.family, size=12)
+        self.pdf.ln(10)
+
+    def add_paragraphs(self, paragraphs):
+        layout_paragraphs(self.pdf, paragraphs)
+
+    def add_chapter(self, chapter):
+        pdf = self.pdf
+        if not self.chapters:
+            if self.toc:
+                # The placeholder breaks the page, the first chapter starts on the new one
+                pdf.add_page()
+                pdf.insert_toc_placeholder(_render_toc_placeholder, allow_extra_pages=True)
+                pdf.set_page_label("D", label_start=1)
+            else:
+                pdf.add_page(label_style="D", label_start=1)
+        self.chapters += 1
+        layout_chapter(pdf, chapter, new_page=self.chapters > 1)
+
+    def draw_cover(self, cover_image_path):
+        """Draws the cover image on the reserved first page."""
+        pdf = self.pdf
+        cover_width = pdf.w - 20
+        if self.cover_dpi:
+            cover_image_path = prepare_cover_image(
+                cover_image_path, width_mm=cover_width, dpi=self.cover_dpi, quality=self.cover_quality
+            )["pdf"]
+        last_page = pdf.page
+        pdf.page = 1
+        pdf.image(cover_image_path, x=10, y=10, w=cover_width)
+        pdf.page = last_page
+
+    def save(self, cover_image_path, output_filename):
+        """Draws the cover image on the reserved first page and writes the PDF."""
+        self.draw_cover(cover_image_path)
+
+        # Save the PDF to the specified output file
+        try:
+            self.pdf.output(output_filename)
+            return f"PDF ebook generated successfully: {output_filename}"
+        except Exception as e:
+            raise Exception(f"Failed to generate PDF ebook: {str(e)}")
+
+
+def render_chapter_fragment(chapter):
+    """
+    Lays out a single chapter as a standalone PDF. Runs in the render pool's worker
+    processes; returns the PDF bytes and the chapter outline with fragment page numbers.
+    """
+    pdf = new_pdf()
+    outline = layout_chapter(pdf, chapter)
+    return bytes(pdf.output()), outline
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    """
+    Returns the process pool shared by every parallel PDF layout, or None on a single
+    core, where chapters are laid out in the calling process instead.
+
+    Workers are started by a forkserver (spawned where there is none) rather than forked
+    from the caller, which runs the scheduler, cache and prefetch threads, so no worker
+    inherits a lock held by one of them at fork time.
+    """
+    global _render_pool
+    workers = os.cpu_count() or 1
+    if workers < 2:
+        return None
+    with _render_pool_lock:
+        if _render_pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _render_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+        return _render_pool
+
+
+class ParallelPDFWriter:
+    """
+    Drop-in replacement for EbookPDFWriter that lays out every chapter as a separate PDF
+    fragment in the render process pool, so layout scales across cores and overlaps with
+    whatever produces the chapters. The cover, title page and front matter are laid out
+    here, and `save` merges them with the fragments in order, adding an outline entry per
+    chapter and section and page labels (roman for the front matter, then 1, 2, ...).
+    With `toc`, `save` lays out the table of contents at the end of the front matter from
+    the fragment outlines and links its entries to the merged pages.
+
+    With `use_cache`, fragments are kept in the fragment cache and a chapter whose content
+    and layout settings did not change since an earlier render is not laid out again.
+
+    Finished fragments are spooled to a temporary directory and only their paths and
+    outlines are kept, and a chapter is dropped as soon as its fragment is finished.
+    Once `max_pending` chapters are being laid out, `add_chapter` waits for one of them,
+    so memory stays bounded by the chapters in flight until `save` merges the fragments.
+
+    Front matter paragraphs must be added before the first chapter. Chapters whose worker
+    fails are laid out in this process instead.
+    """
+
+    def __init__(self, title, cover_dpi=150, cover_quality=85, executor=None, use_cache=True, toc=True,
+                 max_pending=None):
+        self.front = EbookPDFWriter(title, cover_dpi=cover_dpi, cover_quality=cover_quality, toc=False)
+        self.toc = toc
+        self.executor = executor or get_render_pool()
+        self.cache = get_fragment_cache() if use_cache else None
+        self.max_pending = max_pending or 2 * (os.cpu_count() or 1)
+        # (path, outline) of every chapter's fragment, in order; None while it is being laid out
+        self.fragments = []
+        self.cache_hits = 0
+        self._pending = []
+        self._spool_dir = None
+
+    def add_paragraphs(self, paragraphs):
+        if self.fragments:
+            raise ValueError("Front matter paragraphs must be added before the first chapter.")
+        self.front.add_paragraphs(paragraphs)
+
+    def add_chapter(self, chapter):
+        index = len(self.fragments)
+        self.fragments.append(None)
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(chapter, layout_settings())
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache_hits += 1
+                self._spool(index, *cached)
+                return
+
+        future = None
+        if self.executor is not None:
+            try:
+                future = self.executor.submit(render_chapter_fragment, chapter)
+            except (BrokenProcessPool, RuntimeError, OSError) as e:
+                logger.warning("Render pool unavailable, laying out in process: %s", e)
+        if future is None:
+            self._finish(index, chapter, None, key)
+            return
+        self._pending.append((index, chapter, future, key))
+        self._collect(self.max_pending)
+
+    def _collect(self, limit):
+        """Spools every finished fragment, waiting for fragments while more than `limit` are in flight."""
+        while True:
+            for entry in [entry for entry in self._pending if entry[2].done()]:
+                self._pending.remove(entry)
+                self._finish(*entry)
+            if len(self._pending) <= limit:
+                return
+            wait([future for _, _, future, _ in self._pending], return_when=FIRST_COMPLETED)
+
+    def _finish(self, index, chapter, future, key):
+        fragment = None
+        if future is not None:
+            try:
+                fragment = future.result()
+            except (BrokenProcessPool, OSError) as e:
+                logger.warning("Chapter fragment failed in the render pool, laying out in process: %s", e)
+        if fragment is None:
+            fragment = render_chapter_fragment(chapter)
+        if key is not None:
+            self.cache.put(key, *fragment)
+        self._spool(index, *fragment)
+
+    def _spool(self, index, data, outline):
+        if self._spool_dir is None:
+            self._spool_dir = tempfile.mkdtemp(prefix="ebook-fragments-")
+        path = os.path.join(self._spool_dir, f"{index}.pdf")
+        with open(path, "wb") as fragment_file:
+            fragment_file.write(data)
+        self.fragments[index] = (path, outline)
+
+    def save(self, cover_image_path, output_filename):
+        """Draws the cover, merges the front matter with the chapter fragments and writes the PDF."""
+        from pypdf import PdfReader
+
+        try:
+            self._collect(0)
+            fragments = [(PdfReader(path), outline) for path, outline in self.fragments]
+            if self.cache is not None:
+                logger.info("Reused %d of %d chapter layouts from the fragment cache",
+                            self.cache_hits, len(self.fragments))
+            return self._merge(fragments, cover_image_path, output_filename)
+        finally:
+            if self._spool_dir is not None:
+                shutil.rmtree(self._spool_dir, ignore_errors=True)
+                self._spool_dir = None
+
+    def _merge(self, fragments, cover_image_path, output_filename):
+        from pypdf import PdfReader, PdfWriter
+        from pypdf.annotations import Link
+
+        # Chapter pages are numbered from 1 whatever the length of the front matter
+        headings = []
+        first_page = 1
+        for reader, outline in fragments:
+            headings.extend((level, heading, first_page + page - 1) for level, heading, page in outline)
+            first_page += len(reader.pages)
+
+        front = self.front.pdf
+        toc_areas = []
+        if self.toc and headings:
+            front.add_page()
+            toc_areas = layout_toc(front, [(level, heading, str(page), None) for level, heading, page in headings])
+        self.front.draw_cover(cover_image_path)
+
+        writer = PdfWriter()
+        writer.append(PdfReader(io.BytesIO(bytes(front.output()))))
+        front_pages = len(writer.pages)
+
+        parent = None
+        for reader, _ in fragments:
+            writer.append(reader, import_outline=False)
+        for level, heading, page in headings:
+            item = writer.add_outline_item(heading, front_pages + page - 1, parent=parent if level else None)
+            if level == 0:
+                parent = item
+        for (page, x, y, w, h), (_, _, target) in zip(toc_areas, headings):
+            rect = (x * front.k, front.h_pt - (y + h) * front.k, (x + w) * front.k, front.h_pt - y * front.k)
+            writer.add_annotation(page - 1, Link(rect=rect, target_page_index=front_pages + target - 1))
+
+        writer.set_page_label(0, front_pages - 1, style="/r")
+        if len(writer.pages) > front_pages:
+            writer.set_page_label(front_pages, len(writer.pages) - 1, style="/D", start=1)
+
+        try:
+            with open(output_filename, "wb") as output_file:
+                writer.write(output_file)
+            return f"PDF ebook generated successfully: {output_filename}"
+        except Exception as e:
+            raise Exception(f"Failed to generate PDF ebook: {str(e)}")
+
+
+def _pdf_writer(title, parallel, use_cache, toc, cover_dpi):
+    if parallel:
+        return ParallelPDFWriter(title, cover_dpi=cover_dpi, use_cache=use_cache, toc=toc)
+    return EbookPDFWriter(title, cover_dpi=cover_dpi, toc=toc)
+
+
+def _save(writer, cover_image_path, output_filename, optimize):
+    result = writer.save(cover_image_path, output_filename)
+    if optimize:
+        result += f"\nOptimized for web: {describe_optimization(optimize_pdf(output_filename))}"
+    return result
+
+
+def render_chapters_pdf(title, chapters, cover_image_path, output_filename, parallel=False, use_cache=True,
+                        toc=True, optimize=False, cover_dpi=150):
+    """
+    Lays out chapters from any iterable, such as a chapter stream, as they arrive.
+    Chapters are not kept once laid out: in a single process they only live on as pages
+    of the PDF document, and with `parallel`, the render process pool lays them out and
+    the finished fragments are spooled to disk until they are merged. With
+    `use_cache` as well, unchanged chapters are reused from the fragment cache.
+    With `toc`, a table of contents is added before the first chapter, and with
+    `optimize`, the PDF is compacted and linearized for fast web view. The cover is
+    prepared at `cover_dpi`, or embedded as is when it is None.
+    """
+    writer = _pdf_writer(title, parallel, use_cache, toc, cover_dpi)
+    for chapter in chapters:
+        writer.add_chapter(chapter)
+    return _save(writer, cover_image_path, output_filename, optimize)
+
+
+def render_ebook_pdf(book, cover_image_path, output_filename, parallel=False, use_cache=True, toc=True,
+                     optimize=False, cover_dpi=150):
+    """
+    Lays out a Book as a PDF with the cover image as the first page, followed by a
+    title page, a table of contents with `toc`, and one page break per chapter. With
+    `parallel`, chapters are laid out in the render process pool, and with `use_cache`
+    as well, unchanged chapters are reused from the fragment cache. With `optimize`,
+    the PDF is compacted and linearized for fast web view, and the result reports the
+    size before and after. The cover is prepared at `cover_dpi`, or embedded as is when
+    it is None, e.g. when the caller already prepared it.
+    """
+    writer = _pdf_writer(book.title, parallel, use_cache, toc, cover_dpi)
+    writer.add_paragraphs(book.paragraphs)
+    for chapter in book.chapters:
+        writer.add_chapter(chapter)
+    return _save(writer, cover_image_path, output_filename, optimize)
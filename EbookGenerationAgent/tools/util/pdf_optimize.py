@@ -0,0 +1,77 @@
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+def _temp_path(path):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".part")
+    os.close(fd)
+    return tmp_path
+
+
+def _compact(source_path, output_path):
+    """Deflates every content stream and stores identical objects once."""
+    from pypdf import PdfWriter
+
+    writer = PdfWriter(clone_from=source_path)
+    for page in writer.pages:
+        page.compress_content_streams()
+    # Merged chapter fragments each embed their own copy of the font descriptors, encodings and images
+    writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+    with open(output_path, "wb") as output_file:
+        writer.write(output_file)
+
+
+def _linearize(source_path, output_path):
+    """Writes a linearized copy with the non-stream objects packed into compressed object streams."""
+    import pikepdf
+
+    with pikepdf.open(source_path) as pdf:
+        pdf.save(
+            output_path,
+            linearize=True,
+            compress_streams=True,
+            object_stream_mode=pikepdf.ObjectStreamMode.generate,
+        )
+
+
+def optimize_pdf(path, linearize=True):
+    """
+    Rewrites a PDF in place for delivery: content streams are deflated, identical objects
+    are stored once and, with `linearize`, the file is linearized ("fast web view"), so a
+    reader can show the first page while the rest is still downloading through HTTP range
+    requests. Linearization needs pikepdf; without it the file is only compacted.
+
+    Returns {"size_before", "size_after", "linearized"}, sizes in bytes.
+    """
+    size_before = os.path.getsize(path)
+    compact_path = _temp_path(path)
+    linear_path = None
+    try:
+        _compact(path, compact_path)
+        result_path, linearized = compact_path, False
+        if linearize:
+            try:
+                linear_path = _temp_path(path)
+                _linearize(compact_path, linear_path)
+                result_path, linearized = linear_path, True
+            except ImportError:
+                logger.warning("pikepdf is not installed, writing %s without linearization", path)
+
+        # A compacted file that did not get smaller is not worth replacing the original for
+        if linearized or os.path.getsize(result_path) < size_before:
+            os.replace(result_path, path)
+    finally:
+        for tmp_path in (compact_path, linear_path):
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+    return {"size_before": size_before, "size_after": os.path.getsize(path), "linearized": linearized}
+
+
+def describe_optimization(stats):
+    """Formats optimize_pdf statistics for tool results."""
+    saved = 1 - stats["size_after"] / stats["size_before"] if stats["size_before"] else 0
+    return (f"{stats['size_before'] / 1024:.1f} KB -> {stats['size_after'] / 1024:.1f} KB "
+            f"({saved:.0%} smaller{', linearized' if stats['linearized'] else ''})")
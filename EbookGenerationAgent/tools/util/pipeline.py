@@ -0,0 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Pipeline:
+    """
+    Small dependency graph of named steps. Every step starts on its own thread as soon
+    as the steps it depends on have finished and receives their results as keyword
+    arguments, so independent steps run concurrently.
+    """
+
+    def __init__(self):
+        self.steps = {}
+
+    def add(self, name, func, depends_on=()):
+        for dependency in depends_on:
+            if dependency not in self.steps:
+                raise ValueError(f"Step '{name}' depends on unknown step '{dependency}'.")
+        self.steps[name] = (func, tuple(depends_on))
+        return self
+
+    def run(self):
+        """Runs every step and returns their results by name, raising the first failure."""
+        futures = {}
+
+        def run_step(func, depends_on):
+            return func(**{dependency: futures[dependency].result() for dependency in depends_on})
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.steps))) as executor:
+            # Steps are submitted in insertion order, so dependencies always have a future already
+            for name, (func, depends_on) in self.steps.items():
+                futures[name] = executor.submit(run_step, func, depends_on)
+            return {name: future.result() for name, future in futures.items()}
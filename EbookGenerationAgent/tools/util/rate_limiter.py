@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+logger = logging.getLogger(__name__)
+
+# Interactive agent turns (FileWriter, dependency extraction) are served before bulk paragraph jobs
+INTERACTIVE = 0
+BULK = 1
+
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+
+def estimate_tokens(request):
+    """Roughly estimates the tokens a chat completion request will consume (prompt + completion)."""
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in request.get("messages", []))
+    return prompt_chars // 4 + request.get("max_tokens", 0)
+
+
+def _parse_duration(value):
+    """Parses OpenAI reset durations such as '1s', '6m0s' or '20ms' into seconds."""
+    if value is None:
+        return None
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+class TokenBucket:
+    """Token bucket that refills continuously at `capacity` units per minute."""
+
+    def __init__(self, capacity):
+        self.capacity = float(capacity)
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount, reserve=0.0):
+        """Seconds until `amount` can be taken without dipping into the `reserve` fraction."""
+        floor = self.capacity * reserve
+        amount = min(amount, self.capacity - floor)
+        missing = amount + floor - self.level
+        return max(0.0, missing * 60 / self.capacity)
+
+    def sync(self, limit, remaining):
+        """Aligns the bucket with the limits reported by the API."""
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.level = min(self.level, float(remaining))
+
+
+class RequestScheduler:
+    """
+    Process-wide scheduler for OpenAI API calls.
+
+    Requests and estimated tokens are metered with token buckets sized to the account's
+    RPM/TPM limits, which are corrected from the `x-ratelimit-*` headers of every response.
+    The number of requests in flight adapts to the API: it is halved on every rate limit
+    error and grows back by one after each success. Bulk work may not dip into the last
+    `bulk_reserve` fraction of either bucket and yields to waiting interactive requests,
+    so agent turns are not starved by large paragraph jobs. Retryable errors are retried
+    with jittered exponential backoff, honouring any `retry-after` header.
+    """
+
+    def __init__(self, requests_per_minute=500, tokens_per_minute=30000, max_concurrency=32,
+                 bulk_reserve=0.2, max_retries=6, base_delay=1.0, max_delay=60.0):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.bulk_reserve = bulk_reserve
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.rate_limited = 0
+        self._interactive_waiting = 0
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, tokens, priority):
+        """Takes a slot if one is available and returns 0, otherwise returns the seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            if priority == BULK and self._interactive_waiting:
+                return 0.05
+            reserve = self.bulk_reserve if priority == BULK else 0.0
+            slots = self.concurrency if priority == INTERACTIVE else max(1, int(self.concurrency * (1 - reserve)))
+            if self.in_flight >= slots:
+                return 0.05
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            wait = max(self.requests.wait_time(1, reserve), self.tokens.wait_time(tokens, reserve))
+            if wait > 0:
+                return wait
+            self.requests.level -= 1
+            self.tokens.level -= tokens
+            self.in_flight += 1
+            return 0.0
+
+    def _waiting(self, priority, delta):
+        if priority == INTERACTIVE:
+            with self._lock:
+                self._interactive_waiting += delta
+
+    def acquire(self, tokens, priority=BULK):
+        """Blocks until a request estimated at `tokens` tokens may be sent."""
+        self._waiting(priority, 1)
+        try:
+            while (wait := self._try_acquire(tokens, priority)) > 0:
+                time.sleep(min(wait, 1.0))
+        finally:
+            self._waiting(priority, -1)
+
+    async def acquire_async(self, tokens, priority=BULK):
+        """Waits without blocking the event loop until a request may be sent."""
+        self._waiting(priority, 1)
+        try:
+            while (wait := self._try_acquire(tokens, priority)) > 0:
+                await asyncio.sleep(min(wait, 1.0))
+        finally:
+            self._waiting(priority, -1)
+
+    def release(self, headers=None, error=None):
+        """Frees the in-flight slot and adapts the limits to the outcome of the request."""
+        with self._lock:
+            self.in_flight -= 1
+            if headers is not None:
+                self.requests.sync(headers.get("x-ratelimit-limit-requests"),
+                                   headers.get("x-ratelimit-remaining-requests"))
+                self.tokens.sync(headers.get("x-ratelimit-limit-tokens"),
+                                 headers.get("x-ratelimit-remaining-tokens"))
+                if headers.get("x-ratelimit-remaining-requests") == "0":
+                    reset = _parse_duration(headers.get("x-ratelimit-reset-requests"))
+                    if reset:
+                        self.paused_until = max(self.paused_until, time.monotonic() + reset)
+            if isinstance(error, RateLimitError):
+                self.rate_limited += 1
+                self.concurrency = max(1, self.concurrency // 2)
+                retry_after = _retry_after(error)
+                if retry_after:
+                    self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            elif error is None and self.concurrency < self.max_concurrency:
+                self.concurrency += 1
+
+    def backing_off(self):
+        """Returns True while the scheduler is paused or running below its full concurrency after rate limits."""
+        with self._lock:
+            return time.monotonic() < self.paused_until or self.concurrency < self.max_concurrency
+
+    def backoff(self, attempt, error):
+        """Returns the delay before retry number `attempt` (full jitter exponential backoff)."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, _retry_after(error) or 0.0)
+
+    def call(self, send, request, priority=INTERACTIVE):
+        """
+        Sends `request` with `send(**request)`, which must return a raw response
+        (`with_raw_response`), and returns the parsed result, retrying retryable errors.
+        """
+        tokens = estimate_tokens(request)
+        for attempt in range(self.max_retries + 1):
+            self.acquire(tokens, priority)
+            try:
+                raw = send(**request)
+            except RETRYABLE_ERRORS as e:
+                self.release(error=e)
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff(attempt, e)
+                logger.warning("Retrying OpenAI request in %.1fs after %s", delay, type(e).__name__)
+                time.sleep(delay)
+                continue
+            except Exception:
+                self.release(error=True)
+                raise
+            self.release(headers=raw.headers)
+            return raw.parse()
+
+    async def call_async(self, send, request, priority=BULK):
+        """Async counterpart of `call` for coroutine `send` functions."""
+        tokens = estimate_tokens(request)
+        for attempt in range(self.max_retries + 1):
+            await self.acquire_async(tokens, priority)
+            try:
+                raw = await send(**request)
+            except RETRYABLE_ERRORS as e:
+                self.release(error=e)
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff(attempt, e)
+                logger.warning("Retrying OpenAI request in %.1fs after %s", delay, type(e).__name__)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.release(error=True)
+                raise
+            self.release(headers=raw.headers)
+            return raw.parse()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    Returns the process-wide request scheduler. Its limits can be set with the
+    OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT and OPENAI_MAX_CONCURRENCY environment variables.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler(
+                requests_per_minute=int(os.getenv("OPENAI_RPM_LIMIT", "500")),
+                tokens_per_minute=int(os.getenv("OPENAI_TPM_LIMIT", "30000")),
+                max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", "32")),
+            )
+        return _scheduler
@@ -0,0 +1,56 @@
+from agency_swarm.tools import BaseTool
+from pydantic import Field
+from typing import Literal, Optional
+from datetime import datetime, timedelta, timezone
+import stripe
+import os
+from .util import get_payment_ledger
+
+# Set your Stripe API key globally
+stripe.api_key = os.getenv("STRIPE_API_KEY")
+
+PERIOD_DAYS = {"today": 1, "last_7_days": 7, "last_30_days": 30, "all_time": None}
+
+
+class SalesReport(BaseTool):
+    """
+    This tool reports ebook sales from the local payment ledger: the number of successful
+    payments, revenue and refunds per currency over a period, and optionally the payments
+    of one customer. The ledger is first brought up to date by applying the payment events
+    Stripe recorded since the previous sync, so reports do not page through the Stripe
+    API. The webhook receiver also keeps the ledger in sync in the background.
+    """
+
+    period: Literal["today", "last_7_days", "last_30_days", "all_time"] = Field(
+        "today", description="The reporting period. Days start at midnight UTC."
+    )
+    customer_email: Optional[str] = Field(
+        None, description="The email address of a customer whose payments should be listed."
+    )
+    refresh: bool = Field(
+        True, description="Whether to fetch new payments from Stripe before reporting."
+    )
+
+    def run(self):
+        """
+        Syncs the ledger and returns the sales of the period. Amounts are in the smallest
+        currency unit (e.g., cents for USD).
+        """
+        ledger = get_payment_ledger()
+        report = {"period": self.period}
+        if self.refresh:
+            try:
+                report["synced"] = ledger.sync()
+            except stripe.error.StripeError as e:
+                # Reporting from the ledger as it is beats not reporting at all
+                report["warning"] = f"Could not sync with Stripe, the report may miss recent payments: {e.user_message or e}"
+
+        days = PERIOD_DAYS[self.period]
+        since = None
+        if days:
+            today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+            since = int((today - timedelta(days=days - 1)).timestamp())
+        report.update(ledger.sales(since=since))
+        if self.customer_email:
+            report["customer_payments"] = ledger.customer_payments(email=self.customer_email)
+        return report
@@ -1,7 +1,10 @@
 from agency_swarm.tools import BaseTool
 from pydantic import Field
+from typing import Optional
 import stripe
 import os
+import uuid
+from .util import get_customer_index, get_stripe_requests, idempotency_key
 
 # Set your Stripe API key globally
 stripe.api_key = os.getenv("STRIPE_API_KEY")
@@ -12,6 +15,20 @@ class StripePaymentProcessor(BaseTool):
     It can create payment intents, handle webhooks for payment status updates,
     and manage customer data securely. The tool ensures compliance with PCI DSS
     standards and provides error handling for common payment issues.
+
+    Customers are looked up by email in the local customer index, so a repeat buyer's
+    checkout reuses their Stripe customer and makes a single API call.
+
+    Payment intents are created with an idempotency key derived from the order, so
+    retrying a checkout after a timeout returns the same payment intent instead of a
+    duplicate. A checkout without an order ID gets a new one, returned with the payment
+    intent, so a second purchase with the same details is charged separately and only
+    a retry that passes the returned ID back is deduplicated. Rate limit, connection and
+    server errors are retried with backoff, and concurrent checkouts of the same order
+    share a single request.
+
+    Payment status updates arrive through the Stripe webhook receiver in util/webhooks.py,
+    which triggers ebook delivery once a payment succeeds.
     """
 
     amount: int = Field(
@@ -26,53 +43,71 @@ class StripePaymentProcessor(BaseTool):
     description: str = Field(
         ..., description="A description of the payment."
     )
+    order_id: Optional[str] = Field(
+        None, description="Identifier of the order being paid. Retries of the same order return the same payment intent. When omitted, a new order ID is generated and returned; pass it back when retrying this checkout."
+    )
 
     def run(self):
         """
         The implementation of the run method, where the tool's main functionality is executed.
         This method creates a payment intent using the Stripe API.
         """
+        # Every new checkout is a distinct order, only retries that pass its ID back reuse the payment intent,
+        # so the ID is returned with errors too
+        order_id = self.order_id or uuid.uuid4().hex
         try:
-            # Create a new customer
-            customer = stripe.Customer.create(
-                email=self.customer_email,
-                description=self.description
-            )
+            # Reuse the buyer's customer, creating it on their first purchase
+            index = get_customer_index()
+            customer_id = index.get_or_create(self.customer_email, description=self.description)
 
-            # Create a payment intent
-            payment_intent = stripe.PaymentIntent.create(
-                amount=self.amount,
-                currency=self.currency,
-                customer=customer.id,
-                description=self.description,
-                payment_method_types=["card"]
-            )
+            try:
+                payment_intent = self.create_payment_intent(order_id, customer_id)
+            except stripe.error.InvalidRequestError as e:
+                if e.code != "resource_missing" or e.param != "customer":
+                    raise
+                # The indexed customer was deleted in Stripe
+                index.remove(self.customer_email)
+                customer_id = index.get_or_create(self.customer_email, description=self.description,
+                                                  replaces=customer_id)
+                payment_intent = self.create_payment_intent(order_id, customer_id)
 
             # Return the client secret and other relevant details to complete the payment on the client side
             return {
                 "client_secret": payment_intent.client_secret,
-                "customer_id": customer.id,
-                "payment_intent_id": payment_intent.id
+                "customer_id": customer_id,
+                "payment_intent_id": payment_intent.id,
+                "order_id": order_id
             }
 
         except stripe.error.CardError as e:
             # Handle card errors
-            return {"error": f"Card error: {e.user_message}"}
+            return {"error": f"Card error: {e.user_message}", "order_id": order_id}
         except stripe.error.RateLimitError as e:
             # Handle rate limit errors
-            return {"error": "Rate limit error: Too many requests made to the API too quickly"}
+            return {"error": "Rate limit error: Too many requests made to the API too quickly", "order_id": order_id}
         except stripe.error.InvalidRequestError as e:
             # Handle invalid parameters errors
-            return {"error": f"Invalid request: {e.user_message}"}
+            return {"error": f"Invalid request: {e.user_message}", "order_id": order_id}
         except stripe.error.AuthenticationError as e:
             # Handle authentication errors
-            return {"error": "Authentication error: Incorrect API keys"}
+            return {"error": "Authentication error: Incorrect API keys", "order_id": order_id}
         except stripe.error.APIConnectionError as e:
             # Handle network communication errors
-            return {"error": "Network error: Failed to connect to Stripe"}
+            return {"error": "Network error: Failed to connect to Stripe", "order_id": order_id}
         except stripe.error.StripeError as e:
             # Handle generic Stripe errors
-            return {"error": f"Stripe error: {e.user_message}"}
+            return {"error": f"Stripe error: {e.user_message}", "order_id": order_id}
         except Exception as e:
             # Handle other unexpected errors
-            return {"error": f"An unexpected error occurred: {str(e)}"}
+            return {"error": f"An unexpected error occurred: {str(e)}", "order_id": order_id}
+
+    def create_payment_intent(self, order_id, customer_id):
+        return get_stripe_requests().call(
+            stripe.PaymentIntent.create,
+            idempotency_key("payment_intent", order_id, customer_id),
+            amount=self.amount,
+            currency=self.currency,
+            customer=customer_id,
+            description=self.description,
+            payment_method_types=["card"]
+        )
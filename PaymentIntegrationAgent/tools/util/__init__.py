@@ -0,0 +1,9 @@
+from .customer_index import CustomerIndex, customer_sync_job, get_customer_index, normalize_email
+from .event_queue import EventQueue, get_event_queue
+from .ledger import PaymentLedger, get_payment_ledger, ledger_sync_job
+from .periodic import PeriodicJob
+from .stripe_requests import RETRYABLE_ERRORS, StripeRequests, get_stripe_requests, idempotency_key
+from .webhooks import (
+    DELIVERY_EVENTS, WebhookApp, WebhookWorkers, create_webhook_app, delivery_handlers, load_delivery_hook,
+    paid_order, serve_webhooks
+)
@@ -0,0 +1,199 @@
+import os
+import sqlite3
+import threading
+import time
+
+import stripe
+
+from .periodic import PeriodicJob
+from .stripe_requests import get_stripe_requests, idempotency_key
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser("~"), ".cache", "ebook_ai", "stripe_customers.sqlite3")
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+class CustomerIndex:
+    """
+    Local index of Stripe customer ids by email, stored in SQLite, so checkouts of repeat
+    buyers reuse their customer instead of creating a new one per payment.
+
+    The index is warmed by `sync`, which pages through `Customer.list` and afterwards only
+    fetches customers created since the previous sync, and it is updated whenever a
+    customer is created. The webhook receiver runs `sync` periodically (see
+    `customer_sync_job`). When several customers share an email, the oldest one is kept.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        dir_path = os.path.dirname(path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS customers ("
+            "email TEXT PRIMARY KEY, customer_id TEXT NOT NULL, created INTEGER NOT NULL, indexed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS customers_customer_id ON customers (customer_id)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sync_state (name TEXT PRIMARY KEY, value REAL NOT NULL)")
+        self._conn.commit()
+
+    def get(self, email):
+        """Returns the customer id indexed for `email`, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT customer_id FROM customers WHERE email = ?", (normalize_email(email),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, email, customer_id, created=None):
+        """Indexes a customer, unless an older customer is already indexed for the email."""
+        with self._lock:
+            self._put(email, customer_id, created)
+            self._conn.commit()
+
+    def _put(self, email, customer_id, created):
+        self._conn.execute(
+            "INSERT INTO customers (email, customer_id, created, indexed) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (email) DO UPDATE SET customer_id = excluded.customer_id, created = excluded.created, "
+            "indexed = excluded.indexed WHERE excluded.created < customers.created",
+            (normalize_email(email), customer_id, int(created or time.time()), time.time())
+        )
+
+    def email_for(self, customer_id):
+        """Returns the email indexed for a customer id, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT email FROM customers WHERE customer_id = ?", (customer_id,)).fetchone()
+        return row[0] if row else None
+
+    def remove(self, email):
+        """Drops the entry of `email`, for customers that were deleted in Stripe."""
+        with self._lock:
+            self._conn.execute("DELETE FROM customers WHERE email = ?", (normalize_email(email),))
+            self._conn.commit()
+
+    def last_synced(self):
+        """Returns the `created` time of the newest customer seen by `sync`, or None before the first sync."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync_state WHERE name = 'customers_created'").fetchone()
+        return row[0] if row else None
+
+    def sync(self, full=False, page_size=100):
+        """
+        Indexes the customers created in Stripe since the last sync, or every customer
+        with `full`. Pages are requested through the shared Stripe request sender, so
+        rate limit and connection errors are retried. Returns the number of customers read.
+        """
+        params = {"limit": page_size}
+        watermark = None if full else self.last_synced()
+        if watermark is not None:
+            params["created"] = {"gte": int(watermark)}
+
+        count = 0
+        newest = watermark or 0
+        requests = get_stripe_requests()
+        while True:
+            page = requests.call(stripe.Customer.list, **params)
+            self._put_batch([(customer.email, customer.id, customer.created) for customer in page.data
+                             if customer.email])
+            count += len(page.data)
+            newest = max([newest, *(customer.created for customer in page.data)])
+            if not page.has_more or not page.data:
+                break
+            params["starting_after"] = page.data[-1].id
+
+        # The watermark only moves once every page was indexed, so an interrupted run is simply repeated
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (name, value) VALUES ('customers_created', ?)", (newest,)
+            )
+            self._conn.commit()
+        return count
+
+    def _put_batch(self, batch):
+        with self._lock:
+            for email, customer_id, created in batch:
+                self._put(email, customer_id, created)
+            self._conn.commit()
+
+    def get_or_create(self, email, description=None, replaces=None):
+        """
+        Returns the id of the customer with `email`, creating it in Stripe when there is
+        none. Before the first sync, Stripe is asked for an existing customer on a miss.
+        The customer is created with an idempotency key derived from the email and the
+        request parameters, so processes racing on the same new buyer still create a
+        single customer, while a later create with other parameters is not rejected by
+        Stripe as a reused key. Pass the id of a customer that was deleted in Stripe as
+        `replaces` to create a new one.
+        """
+        customer_id = self.get(email)
+        if customer_id:
+            return customer_id
+
+        # Concurrent checkouts of a new buyer must not create two customers
+        with _email_lock(email):
+            customer_id = self.get(email)
+            if customer_id:
+                return customer_id
+            if self.last_synced() is None:
+                existing = get_stripe_requests().call(stripe.Customer.list, email=email, limit=1).data
+                if existing:
+                    self.put(email, existing[0].id, existing[0].created)
+                    return existing[0].id
+            customer = get_stripe_requests().call(
+                stripe.Customer.create, idempotency_key("customer", normalize_email(email), description, replaces),
+                email=email, description=description
+            )
+            self.put(email, customer.id, customer.created)
+            return customer.id
+
+
+_email_locks = {}
+_email_locks_lock = threading.Lock()
+
+
+def _email_lock(email):
+    with _email_locks_lock:
+        return _email_locks.setdefault(normalize_email(email), threading.Lock())
+
+
+_index = None
+_index_lock = threading.Lock()
+
+DEFAULT_SYNC_INTERVAL = 3600
+
+
+def get_customer_index():
+    """
+    Returns the process-wide customer index. The database location can be changed with
+    the STRIPE_CUSTOMER_INDEX_PATH environment variable.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = CustomerIndex(os.getenv("STRIPE_CUSTOMER_INDEX_PATH", DEFAULT_INDEX_PATH))
+        return _index
+
+
+def customer_sync_job():
+    """
+    Returns the periodic job keeping the customer index in sync with Stripe, run every
+    STRIPE_CUSTOMER_SYNC_INTERVAL seconds (default one hour), or None when the interval is 0.
+    """
+    interval = float(os.getenv("STRIPE_CUSTOMER_SYNC_INTERVAL", DEFAULT_SYNC_INTERVAL))
+    if interval <= 0:
+        return None
+    return PeriodicJob("customer index sync", lambda: get_customer_index().sync(), interval)
+
+
+if __name__ == "__main__":
+    import sys
+
+    stripe.api_key = os.getenv("STRIPE_API_KEY")
+    synced = get_customer_index().sync(full="--full" in sys.argv)
+    print(f"Indexed {synced} Stripe customers")
@@ -0,0 +1,191 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "ebook_ai", "stripe_events.sqlite3")
+
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+
+class EventQueue:
+    """
+    Durable queue of Stripe webhook events stored in SQLite.
+
+    Events are keyed on their Stripe event id, so redeliveries of an event that is already
+    queued or processed are dropped. A claimed event is leased for `lease` seconds; if its
+    worker dies, it becomes available again once the lease expires. Failed events are
+    retried with exponential backoff and marked failed after `max_attempts`; failed events
+    are kept as dead letters, listed by `failed` and queued again with `requeue`.
+    Processed events are kept for `retention` seconds so late redeliveries are still
+    recognised.
+    """
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH, lease=300, max_attempts=8, base_delay=5.0, max_delay=3600.0,
+                 retention=30 * 24 * 3600):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retention = retention
+        self._lock = threading.Lock()
+
+        dir_path = os.path.dirname(path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL with synchronous=NORMAL survives process crashes, which is what acknowledging an event needs
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id TEXT PRIMARY KEY, type TEXT NOT NULL, payload BLOB NOT NULL, status TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL, received REAL NOT NULL, "
+            "updated REAL NOT NULL, error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS events_available ON events (status, available_at)")
+        self._conn.commit()
+
+    def push(self, event_id, event_type, payload):
+        """Queues an event. Returns False when the event id was seen before."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO events (id, type, payload, status, available_at, received, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (event_id, event_type, payload, PENDING, now, now, now)
+            )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def claim(self):
+        """
+        Leases the oldest available event, including events whose lease expired.
+        Returns (event_id, event_type, payload, attempts), or None when nothing is due.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE events SET status = ?, attempts = attempts + 1, available_at = ?, updated = ? "
+                "WHERE id = (SELECT id FROM events WHERE status IN (?, ?) AND available_at <= ? "
+                "ORDER BY available_at LIMIT 1) "
+                "RETURNING id, type, payload, attempts",
+                (PROCESSING, now + self.lease, now, PENDING, PROCESSING, now)
+            ).fetchone()
+            self._conn.commit()
+        return row
+
+    def complete(self, event_id):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE events SET status = ?, updated = ?, error = NULL WHERE id = ?", (DONE, now, event_id)
+            )
+            self._conn.commit()
+
+    def fail(self, event_id, attempts, error):
+        """
+        Schedules a retry of a failed event, or marks it failed after `max_attempts`.
+        Returns the new status of the event.
+        """
+        now = time.time()
+        status = FAILED if attempts >= self.max_attempts else PENDING
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        with self._lock:
+            self._conn.execute(
+                "UPDATE events SET status = ?, available_at = ?, updated = ?, error = ? WHERE id = ?",
+                (status, now + delay, now, error, event_id)
+            )
+            self._conn.commit()
+        if status == FAILED:
+            logger.error("Webhook event %s failed %d times and was moved to the dead letters: %s",
+                         event_id, attempts, error)
+        return status
+
+    def failed(self, limit=100):
+        """Returns the failed events, most recent first, as dicts without their payload."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT id, type, attempts, received, updated, error FROM events WHERE status = ? "
+                "ORDER BY updated DESC LIMIT ?", (FAILED, limit)
+            )
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def requeue(self, event_ids=None):
+        """
+        Queues failed events again with a fresh attempt count, all of them or the given
+        ids, e.g. after the bug that made them fail was fixed. Returns the number requeued.
+        """
+        now = time.time()
+        query = "UPDATE events SET status = ?, attempts = 0, available_at = ?, updated = ? WHERE status = ?"
+        params = [PENDING, now, now, FAILED]
+        if event_ids is not None:
+            event_ids = list(event_ids)
+            query += f" AND id IN ({', '.join('?' * len(event_ids))})"
+            params.extend(event_ids)
+        with self._lock:
+            cursor = self._conn.execute(query, params)
+            self._conn.commit()
+        return cursor.rowcount
+
+    def next_available(self):
+        """Returns the time the next pending event becomes available, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(available_at) FROM events WHERE status IN (?, ?)", (PENDING, PROCESSING)
+            ).fetchone()
+        return row[0]
+
+    def purge(self):
+        """Removes processed events older than the retention period."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM events WHERE status = ? AND updated < ?", (DONE, time.time() - self.retention)
+            )
+            self._conn.commit()
+
+    def stats(self):
+        """Returns the number of events per status."""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM events GROUP BY status").fetchall()
+        return {PENDING: 0, PROCESSING: 0, DONE: 0, FAILED: 0, **dict(rows)}
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_event_queue():
+    """
+    Returns the process-wide webhook event queue. The database location can be changed
+    with the STRIPE_EVENT_QUEUE_PATH environment variable.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = EventQueue(os.getenv("STRIPE_EVENT_QUEUE_PATH", DEFAULT_QUEUE_PATH))
+        return _queue
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Inspect and requeue failed Stripe webhook events.")
+    parser.add_argument("--requeue", nargs="*", metavar="EVENT_ID",
+                        help="Queue the given failed events again, or every failed event when no id is given.")
+    parser.add_argument("--limit", type=int, default=100, help="Number of failed events to list.")
+    args = parser.parse_args()
+    queue = get_event_queue()
+    if args.requeue is not None:
+        print(f"Requeued {queue.requeue(args.requeue or None)} events")
+    else:
+        print(json.dumps({"stats": queue.stats(), "failed": queue.failed(args.limit)}, indent=2))
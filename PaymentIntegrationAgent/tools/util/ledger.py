@@ -0,0 +1,285 @@
+import os
+import sqlite3
+import threading
+import time
+
+import stripe
+
+from .customer_index import get_customer_index, normalize_email
+from .periodic import PeriodicJob
+from .stripe_requests import get_stripe_requests
+
+DEFAULT_LEDGER_PATH = os.path.join(os.path.expanduser("~"), ".cache", "ebook_ai", "stripe_ledger.sqlite3")
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS payment_intents ("
+    "id TEXT PRIMARY KEY, customer_id TEXT, email TEXT, amount INTEGER NOT NULL, amount_received INTEGER NOT NULL, "
+    "currency TEXT NOT NULL, status TEXT NOT NULL, description TEXT, created INTEGER NOT NULL, synced REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS payment_intents_customer ON payment_intents (customer_id)",
+    "CREATE INDEX IF NOT EXISTS payment_intents_status_created ON payment_intents (status, created)",
+    "CREATE INDEX IF NOT EXISTS payment_intents_created ON payment_intents (created)",
+    "CREATE TABLE IF NOT EXISTS charges ("
+    "id TEXT PRIMARY KEY, payment_intent_id TEXT, customer_id TEXT, email TEXT, amount INTEGER NOT NULL, "
+    "amount_refunded INTEGER NOT NULL, currency TEXT NOT NULL, status TEXT NOT NULL, created INTEGER NOT NULL, "
+    "synced REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS charges_customer ON charges (customer_id)",
+    "CREATE INDEX IF NOT EXISTS charges_status_created ON charges (status, created)",
+    "CREATE INDEX IF NOT EXISTS charges_created ON charges (created)",
+    "CREATE INDEX IF NOT EXISTS charges_payment_intent ON charges (payment_intent_id)",
+    "CREATE TABLE IF NOT EXISTS sync_state (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+]
+
+# Events carrying a payment intent or a charge; `sync` applies them to the ledger
+EVENT_TYPES = [
+    "payment_intent.created", "payment_intent.processing", "payment_intent.requires_action",
+    "payment_intent.amount_capturable_updated", "payment_intent.partially_funded", "payment_intent.succeeded",
+    "payment_intent.payment_failed", "payment_intent.canceled",
+    "charge.pending", "charge.succeeded", "charge.failed", "charge.captured", "charge.expired", "charge.refunded",
+    "charge.updated",
+]
+# Stripe keeps events for 30 days; an older cursor cannot be resumed
+EVENT_RETENTION = 30 * 24 * 3600
+# Margin for the clock difference with Stripe when the event cursor starts at a listing
+CLOCK_MARGIN = 300
+
+
+def _email(email):
+    return normalize_email(email) if email else None
+
+
+def _payment_intent_row(payment_intent, now):
+    return (
+        payment_intent.id, payment_intent.customer, _email(payment_intent.receipt_email), payment_intent.amount,
+        payment_intent.amount_received or 0, payment_intent.currency, payment_intent.status,
+        payment_intent.description, payment_intent.created, now,
+    )
+
+
+def _charge_row(charge, now):
+    billing_email = charge.billing_details.email if charge.billing_details else None
+    return (
+        charge.id, charge.payment_intent, charge.customer, _email(charge.receipt_email or billing_email),
+        charge.amount, charge.amount_refunded or 0, charge.currency, charge.status, charge.created, now,
+    )
+
+
+class PaymentLedger:
+    """
+    Local SQLite ledger of Stripe payment intents and charges, indexed on customer,
+    status and creation date, so sales reports are answered locally instead of paging
+    through the Stripe API.
+
+    `sync` applies the payment intent and charge events Stripe recorded since a persisted
+    event cursor, so a run usually reads a single page of `/v1/events` however old the
+    changed objects are. Every `reconcile_interval` seconds, and when there is no usable
+    cursor, `reconcile` first pages through the objects created since a persisted
+    `created` watermark, re-reading the `lookback` seconds before it; objects are upserted,
+    so the overlap only refreshes them. Run `sync(full=True)` to rebuild the whole ledger.
+    """
+
+    RESOURCES = {
+        "payment_intents": (
+            "PaymentIntent", _payment_intent_row,
+            "INSERT OR REPLACE INTO payment_intents (id, customer_id, email, amount, amount_received, currency, "
+            "status, description, created, synced) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        ),
+        "charges": (
+            "Charge", _charge_row,
+            "INSERT OR REPLACE INTO charges (id, payment_intent_id, customer_id, email, amount, amount_refunded, "
+            "currency, status, created, synced) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        ),
+    }
+
+    def __init__(self, path=DEFAULT_LEDGER_PATH, lookback=24 * 3600, reconcile_interval=24 * 3600):
+        self.path = path
+        self.lookback = lookback
+        self.reconcile_interval = reconcile_interval
+        self._lock = threading.Lock()
+
+        dir_path = os.path.dirname(path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+        self._conn.commit()
+
+    def watermark(self, resource):
+        """
+        Returns the `created` time of the newest synced object of a resource, or None.
+        "events" gives the event cursor and "reconciled" the time of the last reconcile.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync_state WHERE name = ?", (resource,)).fetchone()
+        return row[0] if row else None
+
+    def _set_watermark(self, name, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)", (name, value))
+            self._conn.commit()
+
+    def sync(self, full=False, page_size=100):
+        """
+        Applies the events recorded since the last sync, reconciling first when it is
+        due. Returns the number of objects and events read per resource.
+        """
+        now = int(time.time())
+        cursor = None if full else self.watermark("events")
+        if cursor is not None and cursor < now - EVENT_RETENTION + 3600:
+            cursor = None
+        reconciled = self.watermark("reconciled")
+        counts = {}
+        if cursor is None or reconciled is None or reconciled < now - self.reconcile_interval:
+            counts.update(self.reconcile(full, page_size))
+        if cursor is None:
+            # Changes made while the listing ran are picked up from the events
+            cursor = now - CLOCK_MARGIN
+        counts["events"] = self._apply_events(cursor, page_size)
+        return counts
+
+    def reconcile(self, full=False, page_size=100):
+        """
+        Pages through the payment intents and charges created since the watermarks (minus
+        the lookback), or all of them with `full`. Returns the number of objects read per
+        resource.
+        """
+        started = int(time.time())
+        counts = {resource: self._sync(resource, full, page_size) for resource in self.RESOURCES}
+        self._set_watermark("reconciled", started)
+        return counts
+
+    def _apply_events(self, cursor, page_size):
+        """Upserts the objects of the events created since `cursor` and moves the cursor past them."""
+        params = {"limit": page_size, "types": EVENT_TYPES, "created": {"gte": cursor}}
+        events = []
+        requests = get_stripe_requests()
+        while True:
+            page = requests.call(stripe.Event.list, **params)
+            events.extend(page.data)
+            if not page.has_more or not page.data:
+                break
+            params["starting_after"] = page.data[-1].id
+
+        # Events are listed newest first; applied oldest first, every object ends in its latest state
+        now = time.time()
+        rows = {resource: [] for resource in self.RESOURCES}
+        for event in reversed(events):
+            item = event.data.object
+            resource = {"payment_intent": "payment_intents", "charge": "charges"}.get(item.object)
+            if resource is not None:
+                rows[resource].append(self.RESOURCES[resource][1](item, now))
+        with self._lock:
+            for resource, resource_rows in rows.items():
+                self._conn.executemany(self.RESOURCES[resource][2], resource_rows)
+            self._conn.commit()
+        # Events of the cursor's second are read again next time, since more may arrive within it
+        self._set_watermark("events", max([cursor, *(event.created for event in events)]))
+        return len(events)
+
+    def _sync(self, resource, full, page_size):
+        api_resource, to_row, insert = self.RESOURCES[resource]
+        list_method = getattr(stripe, api_resource).list
+        watermark = None if full else self.watermark(resource)
+        params = {"limit": page_size}
+        if watermark is not None:
+            params["created"] = {"gte": max(0, watermark - self.lookback)}
+
+        count = 0
+        newest = watermark or 0
+        requests = get_stripe_requests()
+        while True:
+            page = requests.call(list_method, **params)
+            now = time.time()
+            with self._lock:
+                self._conn.executemany(insert, [to_row(item, now) for item in page.data])
+                self._conn.commit()
+            count += len(page.data)
+            newest = max([newest, *(item.created for item in page.data)])
+            if not page.has_more or not page.data:
+                break
+            params["starting_after"] = page.data[-1].id
+
+        # The watermark only moves once every page was stored, so an interrupted run is simply repeated
+        self._set_watermark(resource, newest)
+        return count
+
+    def sales(self, since=None, until=None):
+        """
+        Returns the succeeded payments created in [since, until) as {"sales", "revenue",
+        "refunded"}, where revenue and refunds are amounts per currency in the smallest
+        currency unit.
+        """
+        since = since or 0
+        until = until or 2 ** 62
+        with self._lock:
+            sales = self._conn.execute(
+                "SELECT currency, COUNT(*), SUM(amount_received) FROM payment_intents "
+                "WHERE status = 'succeeded' AND created >= ? AND created < ? GROUP BY currency",
+                (since, until)
+            ).fetchall()
+            refunds = self._conn.execute(
+                "SELECT currency, SUM(amount_refunded) FROM charges "
+                "WHERE status = 'succeeded' AND amount_refunded > 0 AND created >= ? AND created < ? GROUP BY currency",
+                (since, until)
+            ).fetchall()
+        return {
+            "sales": sum(count for _, count, _ in sales),
+            "revenue": {currency: total for currency, _, total in sales},
+            "refunded": dict(refunds),
+        }
+
+    def customer_payments(self, customer_id=None, email=None):
+        """
+        Returns the payment intents of a customer, newest first. A customer given by email
+        also matches payments of the customer id indexed for that email. Emails are
+        compared case-insensitively.
+        """
+        email = _email(email)
+        if customer_id is None and email:
+            customer_id = get_customer_index().get(email)
+        with self._lock:
+            # Rows synced before emails were normalized on write still match
+            cursor = self._conn.execute(
+                "SELECT id, amount, amount_received, currency, status, description, created FROM payment_intents "
+                "WHERE customer_id = ? OR lower(trim(email)) = ? ORDER BY created DESC", (customer_id, email)
+            )
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+DEFAULT_SYNC_INTERVAL = 300
+
+
+def get_payment_ledger():
+    """
+    Returns the process-wide payment ledger. The database location can be changed with
+    the STRIPE_LEDGER_PATH environment variable.
+    """
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = PaymentLedger(os.getenv("STRIPE_LEDGER_PATH", DEFAULT_LEDGER_PATH))
+        return _ledger
+
+
+def ledger_sync_job():
+    """
+    Returns the periodic job keeping the ledger in sync with Stripe, run every
+    STRIPE_LEDGER_SYNC_INTERVAL seconds (default five minutes), or None when the interval is 0.
+    """
+    interval = float(os.getenv("STRIPE_LEDGER_SYNC_INTERVAL", DEFAULT_SYNC_INTERVAL))
+    if interval <= 0:
+        return None
+    return PeriodicJob("payment ledger sync", lambda: get_payment_ledger().sync(), interval)
+
+
+if __name__ == "__main__":
+    import sys
+
+    stripe.api_key = os.getenv("STRIPE_API_KEY")
+    counts = get_payment_ledger().sync(full="--full" in sys.argv)
+    print(", ".join(f"{count} {resource}" for resource, count in counts.items()) + " synced")
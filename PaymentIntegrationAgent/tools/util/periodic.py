@@ -0,0 +1,61 @@
+import asyncio
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicJob:
+    """
+    Runs a blocking `function` every `interval` seconds in a worker thread, from a task on
+    the running event loop, e.g. next to the webhook workers in the receiver's lifespan.
+
+    A run that raises is logged and retried after `retry_delay` seconds, doubling on every
+    consecutive failure up to `interval`. Start times are jittered by up to `jitter` of
+    the interval so several processes do not hit the API at the same moment.
+    """
+
+    def __init__(self, name, function, interval, retry_delay=30.0, jitter=0.1):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self.jitter = jitter
+        self.runs = 0
+        self.failures = 0
+        self.last_success = None
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Stops scheduling runs. A run in progress finishes in its thread."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        consecutive_failures = 0
+        delay = random.uniform(0, self.interval * self.jitter)
+        while True:
+            await asyncio.sleep(delay)
+            self.runs += 1
+            try:
+                result = await asyncio.to_thread(self.function)
+            except Exception as e:
+                self.failures += 1
+                consecutive_failures += 1
+                delay = min(self.interval, self.retry_delay * 2 ** (consecutive_failures - 1))
+                logger.warning("%s failed (%d in a row), retrying in %.0fs: %s", self.name, consecutive_failures,
+                               delay, e)
+                continue
+            consecutive_failures = 0
+            self.last_success = time.time()
+            logger.info("%s finished: %s", self.name, result)
+            delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
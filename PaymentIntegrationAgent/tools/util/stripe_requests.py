@@ -0,0 +1,111 @@
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import stripe
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (stripe.error.RateLimitError, stripe.error.APIConnectionError, stripe.error.APIError)
+
+
+def idempotency_key(operation, *parts):
+    """
+    Derives a Stripe idempotency key from an operation name and the values identifying
+    the request, so every retry of the same request sends the same key.
+    """
+    digest = hashlib.sha256(json.dumps([operation, *parts], sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{operation}-{digest[:40]}"
+
+
+def _retry_after(error):
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or 0)
+    except ValueError:
+        return 0.0
+
+
+class StripeRequests:
+    """
+    Sends Stripe API requests with idempotency keys, retrying rate limit, connection and
+    server errors with jittered exponential backoff. The stripe library's own network
+    retries are turned off for these requests. Concurrent calls with the same idempotency
+    key are coalesced into one request whose result they all share, so a burst of
+    identical checkouts reaches Stripe once.
+    """
+
+    def __init__(self, max_retries=4, base_delay=0.5, max_delay=8.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt, error):
+        """Returns the delay before retry number `attempt` (full jitter exponential backoff)."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, _retry_after(error))
+
+    def call(self, method, idempotency_key=None, **params):
+        """
+        Calls a Stripe API method such as `stripe.PaymentIntent.create` with `params`.
+        Requests that create objects should pass an `idempotency_key`; reads can omit it.
+        """
+        if idempotency_key is None:
+            return self._send(method, params)
+
+        with self._lock:
+            future = self._in_flight.get(idempotency_key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[idempotency_key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = self._send(method, {**params, "idempotency_key": idempotency_key})
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[idempotency_key]
+        future.set_result(result)
+        return result
+
+    def _send(self, method, params):
+        # Retries happen here only, stripe's own network retries would multiply them
+        params = {**params, "max_network_retries": 0}
+        for attempt in range(self.max_retries + 1):
+            try:
+                return method(**params)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff(attempt, e)
+                with self._lock:
+                    self.retries += 1
+                logger.warning("Retrying Stripe request in %.1fs after %s", delay, type(e).__name__)
+                time.sleep(delay)
+
+
+_requests = None
+_requests_lock = threading.Lock()
+
+
+def get_stripe_requests():
+    """Returns the process-wide Stripe request sender."""
+    global _requests
+    with _requests_lock:
+        if _requests is None:
+            _requests = StripeRequests()
+        return _requests
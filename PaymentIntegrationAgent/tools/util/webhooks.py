@@ -0,0 +1,277 @@
+import asyncio
+import importlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import stripe
+
+from .customer_index import customer_sync_job, get_customer_index
+from .event_queue import FAILED, get_event_queue
+from .ledger import ledger_sync_job
+
+logger = logging.getLogger(__name__)
+
+# Checkout sessions also emit payment_intent.succeeded, so it is the only event that triggers delivery
+DELIVERY_EVENTS = ("payment_intent.succeeded",)
+
+
+def paid_order(event):
+    """Returns the paid order described by a payment_intent.succeeded event."""
+    payment_intent = event["data"]["object"]
+    customer_id = payment_intent.get("customer")
+    email = payment_intent.get("receipt_email")
+    if not email and customer_id:
+        email = get_customer_index().email_for(customer_id)
+    return {
+        "payment_intent_id": payment_intent["id"],
+        "customer_id": customer_id,
+        "email": email,
+        "amount": payment_intent.get("amount_received", payment_intent.get("amount")),
+        "currency": payment_intent.get("currency"),
+        "description": payment_intent.get("description"),
+        "metadata": payment_intent.get("metadata") or {},
+    }
+
+
+def load_delivery_hook(spec):
+    """
+    Returns the delivery function named by `spec`, a "module:function" string such as
+    "myshop.fulfilment:send_ebook". The function is called with each paid order.
+    """
+    module_name, _, function_name = spec.partition(":")
+    if not module_name or not function_name:
+        raise ValueError(f"Delivery hook must look like 'module:function', got {spec!r}")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def delivery_handlers(deliver):
+    """
+    Returns event handlers calling `deliver(order)` for every successful payment. Events
+    are processed at least once, so `deliver` must tolerate being called again for the
+    same payment intent after a worker crash.
+    """
+    def handle(event):
+        deliver(paid_order(event))
+
+    return {event_type: handle for event_type in DELIVERY_EVENTS}
+
+
+class WebhookWorkers:
+    """
+    Pool of workers processing queued webhook events with the handler registered for
+    their type; events without a handler are marked processed. Handlers run in a thread
+    pool, so they may block. A handler that raises has its event retried by the queue
+    until the event is moved to the queue's dead letters.
+    """
+
+    def __init__(self, queue, handlers, workers=8, poll_interval=1.0):
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.processed = 0
+        self.failed = 0
+        self.dead_letters = 0
+        self._executor = None
+        self._tasks = []
+        self._wakeup = None
+        self._stopping = False
+
+    async def start(self):
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="webhook-worker")
+        await self._run(self.queue.purge)
+        dead_letters = (await self._run(self.queue.stats))[FAILED]
+        if dead_letters:
+            logger.warning("%d webhook events failed for good; list them with `python -m "
+                           "PaymentIntegrationAgent.tools.util.event_queue` and requeue them with --requeue",
+                           dead_letters)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stops claiming events and waits for the events being processed."""
+        self._stopping = True
+        self.notify()
+        await asyncio.gather(*self._tasks)
+        self._tasks = []
+        self._executor.shutdown()
+
+    def notify(self):
+        """Wakes idle workers after an event was queued."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _run(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def _work(self):
+        while not self._stopping:
+            # Cleared before claiming, so an event queued meanwhile still wakes this worker
+            self._wakeup.clear()
+            claimed = await self._run(self.queue.claim)
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            event_id, event_type, payload, attempts = claimed
+            handler = self.handlers.get(event_type)
+            try:
+                if handler is not None:
+                    await self._run(handler, json.loads(payload))
+            except Exception as e:
+                self.failed += 1
+                logger.warning("Webhook event %s (%s) failed on attempt %d: %s", event_id, event_type, attempts, e)
+                status = await self._run(self.queue.fail, event_id, attempts, f"{type(e).__name__}: {e}")
+                if status == FAILED:
+                    self.dead_letters += 1
+            else:
+                self.processed += 1
+                await self._run(self.queue.complete, event_id)
+
+
+async def _respond(send, status, payload):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("ascii"))],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class WebhookApp:
+    """
+    ASGI application receiving Stripe webhooks on POST `path`.
+
+    The Stripe-Signature header is verified against the endpoint secret, the event is
+    written to the durable event queue, and Stripe gets its 200 right away; the work
+    itself is left to `workers`, which the ASGI lifespan starts and stops. Redeliveries
+    of an event id that was already received are acknowledged without queueing them
+    again. `jobs` are periodic jobs started and stopped with the workers.
+    """
+
+    def __init__(self, secret, queue, workers=None, path="/webhook", tolerance=300, max_body=1024 * 1024,
+                 jobs=()):
+        self.secret = secret
+        self.queue = queue
+        self.workers = workers
+        self.jobs = list(jobs)
+        self.path = path
+        self.tolerance = tolerance
+        self.max_body = max_body
+        self.received = 0
+        self.duplicates = 0
+        self.rejected = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+        if scope["path"] != self.path:
+            return await _respond(send, 404, {"error": "Not found"})
+        if scope["method"] != "POST":
+            return await _respond(send, 405, {"error": "Method not allowed"})
+
+        body = bytearray()
+        more_body = True
+        while more_body:
+            message = await receive()
+            body.extend(message.get("body", b""))
+            more_body = message.get("more_body", False)
+            if len(body) > self.max_body:
+                return await _respond(send, 413, {"error": "Payload too large"})
+        body = bytes(body)
+
+        signature = dict(scope["headers"]).get(b"stripe-signature")
+        try:
+            if signature is None:
+                raise stripe.SignatureVerificationError("No Stripe-Signature header", None, body)
+            stripe.WebhookSignature.verify_header(body, signature.decode("latin-1"), self.secret, self.tolerance)
+            event = json.loads(body)
+            event_id, event_type = event["id"], event["type"]
+        except (stripe.SignatureVerificationError, ValueError, KeyError, TypeError) as e:
+            self.rejected += 1
+            logger.warning("Rejected webhook: %s", e)
+            return await _respond(send, 400, {"error": "Invalid webhook"})
+
+        if await asyncio.to_thread(self.queue.push, event_id, event_type, body):
+            self.received += 1
+            if self.workers is not None:
+                self.workers.notify()
+        else:
+            self.duplicates += 1
+        await _respond(send, 200, {"received": True})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                if self.workers is not None:
+                    await self.workers.start()
+                for job in self.jobs:
+                    await job.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for job in self.jobs:
+                    await job.stop()
+                if self.workers is not None:
+                    await self.workers.stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def create_webhook_app(workers=8, deliver=None):
+    """
+    Returns the webhook application, verifying signatures with the STRIPE_WEBHOOK_SECRET
+    environment variable, with a worker pool calling `deliver(order)` for every paid
+    order. `deliver` defaults to the "module:function" named by EBOOK_DELIVERY_HOOK.
+
+    Without a delivery function, events are verified and queued but not processed, so
+    none is marked done before an ebook was actually delivered; a receiver started later
+    with one works through them. The application also keeps the customer index and the
+    payment ledger in sync with Stripe.
+    """
+    secret = os.getenv("STRIPE_WEBHOOK_SECRET")
+    if not secret:
+        raise ValueError("STRIPE_WEBHOOK_SECRET must be set to verify webhook signatures.")
+    if deliver is None and os.getenv("EBOOK_DELIVERY_HOOK"):
+        deliver = load_delivery_hook(os.getenv("EBOOK_DELIVERY_HOOK"))
+    queue = get_event_queue()
+    jobs = [job for job in (customer_sync_job(), ledger_sync_job()) if job is not None]
+    if deliver is None:
+        logger.warning("No ebook delivery hook configured (--deliver or EBOOK_DELIVERY_HOOK): webhook events are "
+                       "queued but not processed until the receiver runs with one")
+        return WebhookApp(secret, queue, jobs=jobs)
+    return WebhookApp(secret, queue, WebhookWorkers(queue, delivery_handlers(deliver), workers=workers), jobs=jobs)
+
+
+def serve_webhooks(host="0.0.0.0", port=8000, workers=8, deliver=None):
+    """Serves the webhook application with uvicorn."""
+    import uvicorn
+
+    uvicorn.run(create_webhook_app(workers=workers, deliver=deliver), host=host, port=port, access_log=False,
+                log_level="info")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Receive Stripe webhooks and trigger ebook delivery.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=8, help="Number of event processing workers.")
+    parser.add_argument("--deliver", default=os.getenv("EBOOK_DELIVERY_HOOK"),
+                        help="Function delivering a paid order, as module:function (default: EBOOK_DELIVERY_HOOK). "
+                             "Without one, events are queued but not processed.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    # Used by the periodic sync jobs
+    stripe.api_key = os.getenv("STRIPE_API_KEY")
+    serve_webhooks(args.host, args.port, args.workers, load_delivery_hook(args.deliver) if args.deliver else None)
@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai_server import FakeOpenAIServer
+
+
+def parse_size(value):
+    chapters, sections, paragraphs = (int(part) for part in value.lower().split("x"))
+    return chapters, sections, paragraphs
+
+
+def run_benchmark(sizes, fake, workdir, warm_cache=False):
+    """
+    Runs create_ebook once per book size against the fake API inside `workdir` and returns
+    one result per size with wall time, request counts, peak traced memory and PDF size.
+    """
+    # Imported late so the environment set up in main() is picked up by the shared singletons
+    from EbookGenerationAgent import EbookGenerationAgent
+    from EbookGenerationAgent.tools.util import get_completion_cache
+
+    # The agent resolves its tools relative to the working directory, so it is created before switching
+    agent = EbookGenerationAgent()
+    os.chdir(workdir)
+    results = []
+    for chapters, sections, paragraphs in sizes:
+        if not warm_cache:
+            get_completion_cache().clear()
+            shutil.rmtree(os.environ["EBOOK_COVER_DIR"], ignore_errors=True)
+            shutil.rmtree(os.environ["EBOOK_FRAGMENT_DIR"], ignore_errors=True)
+        fake.reset_stats()
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = agent.create_ebook(
+            topic="Benchmarking Ebook Generation",
+            chapters=chapters,
+            sections_per_chapter=sections,
+            paragraphs_per_section=paragraphs,
+            writing_style="formal",
+            tone="inspirational"
+        )
+        wall_time = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats = fake.stats()
+        results.append({
+            "size": f"{chapters}x{sections}x{paragraphs}",
+            "paragraphs": chapters * sections * paragraphs,
+            "wall_time_s": round(wall_time, 3),
+            "chat_requests": stats["chat"],
+            "image_requests": stats["images"],
+            "rate_limited": stats["rate_limited"],
+            "errors": stats["errors"],
+            "peak_memory_mb": round(peak_memory / 2 ** 20, 2),
+            "pdf_size_kb": round(os.path.getsize(result.splitlines()[0].split(": ", 1)[1]) / 1024, 1),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark create_ebook against a local fake OpenAI API.")
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=["2x2x2", "5x4x4", "10x5x6"],
+                        help="Book sizes as CHAPTERSxSECTIONSxPARAGRAPHS.")
+    parser.add_argument("--chat-latency", type=float, default=0.5)
+    parser.add_argument("--image-latency", type=float, default=5.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=10000, help="Requests per minute allowed by the fake API.")
+    parser.add_argument("--warm-cache", action="store_true",
+                        help="Keep the completion cache, cover store and fragment cache between runs.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+    sizes = [parse_size(size) if isinstance(size, str) else size for size in args.sizes]
+
+    workdir = tempfile.mkdtemp(prefix="ebook-bench-")
+    fake = FakeOpenAIServer(chat_latency=args.chat_latency, image_latency=args.image_latency,
+                            latency_sigma=args.latency_sigma, error_rate=args.error_rate,
+                            rate_limit_rate=args.rate_limit_rate, requests_per_minute=args.rpm)
+    os.environ.update({
+        "OPENAI_BASE_URL": fake.base_url,
+        "OPENAI_API_KEY": "sk-fake",
+        "OPENAI_RPM_LIMIT": str(args.rpm),
+        "OPENAI_TPM_LIMIT": str(args.rpm * 1000),
+        "COMPLETION_CACHE_PATH": os.path.join(workdir, "completions.sqlite3"),
+        "EBOOK_JOBS_DIR": os.path.join(workdir, "jobs"),
+        "EBOOK_COVER_DIR": os.path.join(workdir, "covers"),
+        "EBOOK_ARTIFACT_DIR": os.path.join(workdir, "artifacts"),
+        "EBOOK_FRAGMENT_DIR": os.path.join(workdir, "fragments"),
+    })
+
+    cwd = os.getcwd()
+    try:
+        with fake:
+            results = run_benchmark(sizes, fake, workdir, warm_cache=args.warm_cache)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    columns = list(results[0])
+    print("  ".join(f"{column:>15}" for column in columns))
+    for result in results:
+        print("  ".join(f"{str(result[column]):>15}" for column in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_stripe import FakeStripe
+
+SECRET = "whsec_benchmark"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_benchmark(events, concurrency, workers, duplicate_rate, bad_signature_rate, handler_latency):
+    """
+    Serves the webhook receiver with uvicorn, delivers `events` signed events from the
+    fake Stripe and waits until the worker pool has processed them. Returns the delivery
+    throughput and latency and the processing throughput.
+    """
+    import uvicorn
+
+    # Imported late so the queue location set up in main() is picked up by the shared singletons
+    from PaymentIntegrationAgent.tools.util import EventQueue, WebhookApp, WebhookWorkers, delivery_handlers
+
+    delivered = []
+    delivered_lock = threading.Lock()
+
+    def deliver(order):
+        time.sleep(handler_latency)
+        with delivered_lock:
+            delivered.append(order["payment_intent_id"])
+
+    queue = EventQueue(os.environ["STRIPE_EVENT_QUEUE_PATH"])
+    workers_pool = WebhookWorkers(queue, delivery_handlers(deliver), workers=workers)
+    app = WebhookApp(SECRET, queue, workers_pool)
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, access_log=False, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    fake = FakeStripe(f"http://127.0.0.1:{port}/webhook", SECRET, concurrency=concurrency,
+                      duplicate_rate=duplicate_rate, bad_signature_rate=bad_signature_rate, seed=1)
+    start = time.perf_counter()
+    stats = asyncio.run(fake.send(events))
+    delivery_time = time.perf_counter() - start
+    while queue.stats()["pending"] or queue.stats()["processing"]:
+        time.sleep(0.01)
+    processing_time = time.perf_counter() - start
+
+    server.should_exit = True
+    thread.join()
+    return {
+        "events": stats["events"],
+        "deliveries": stats["deliveries"],
+        "acknowledged": stats["acknowledged"],
+        "rejected": stats["rejected"],
+        "duplicates_dropped": app.duplicates,
+        "delivered": len(delivered),
+        "unique_delivered": len(set(delivered)),
+        "events_per_min": round(stats["deliveries"] / delivery_time * 60),
+        "ack_p50_ms": stats["p50_ms"],
+        "ack_p99_ms": stats["p99_ms"],
+        "processed_per_min": round(len(delivered) / processing_time * 60),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Stripe webhook receiver against a fake Stripe.")
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50, help="Concurrent deliveries from the fake Stripe.")
+    parser.add_argument("--workers", type=int, default=8, help="Event processing workers.")
+    parser.add_argument("--duplicate-rate", type=float, default=0.05)
+    parser.add_argument("--bad-signature-rate", type=float, default=0.01)
+    parser.add_argument("--handler-latency", type=float, default=0.02, help="Seconds each delivery takes.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="webhook-bench-")
+    os.environ.update({
+        "STRIPE_EVENT_QUEUE_PATH": os.path.join(workdir, "events.sqlite3"),
+        "STRIPE_CUSTOMER_INDEX_PATH": os.path.join(workdir, "customers.sqlite3"),
+    })
+    try:
+        result = run_benchmark(args.events, args.concurrency, args.workers, args.duplicate_rate,
+                               args.bad_signature_rate, args.handler_latency)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    for column, value in result.items():
+        print(f"{column:>20}  {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai_server import FakeOpenAIServer
+
+
+def run_check(chapters, sections, paragraphs):
+    """
+    Generates a book with batched sections against a fake API that rejects every
+    structured-output request, and returns a list of the problems found: generation must
+    finish with every paragraph, falling back to one request per paragraph, and a batch
+    model without structured outputs must be refused before any request is sent.
+    """
+    from EbookGenerationAgent.tools.util import generate_ebook
+
+    problems = []
+    with FakeOpenAIServer(chat_latency=0.01, latency_sigma=0.1, structured_output_models=()) as fake:
+        os.environ["OPENAI_BASE_URL"] = fake.base_url
+        book = generate_ebook("Fallbacks", chapters, sections, paragraphs, "formal", "calm",
+                              batch_sections=True, use_cache=False)
+        stats = fake.stats()
+        generated = sum(len(section.paragraphs) for chapter in book.chapters for section in chapter.sections)
+        if generated != chapters * sections * paragraphs:
+            problems.append(f"expected {chapters * sections * paragraphs} paragraphs, got {generated}")
+        if stats["rejected"] != chapters * sections:
+            problems.append(f"expected {chapters * sections} rejected batches, got {stats['rejected']}")
+        if stats["chat"] != chapters * sections * (paragraphs + 1):
+            problems.append(f"expected {chapters * sections * (paragraphs + 1)} requests, got {stats['chat']}")
+
+        fake.reset_stats()
+        try:
+            generate_ebook("Fallbacks", 1, 1, 1, "formal", "calm", batch_sections=True, use_cache=False,
+                           batch_model="gpt-4")
+            problems.append("a batch model without structured outputs was accepted")
+        except ValueError:
+            pass
+        if fake.stats()["chat"]:
+            problems.append("requests were sent for a batch model without structured outputs")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that batched section generation falls back to single paragraphs when rejected."
+    )
+    parser.add_argument("--chapters", type=int, default=2)
+    parser.add_argument("--sections", type=int, default=2)
+    parser.add_argument("--paragraphs", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="batch-check-")
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-fake",
+        "COMPLETION_CACHE_PATH": os.path.join(workdir, "completions.sqlite3"),
+    })
+    try:
+        problems = run_check(args.chapters, args.sections, args.paragraphs)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    for problem in problems:
+        print(problem)
+    print("batched fallback: " + ("FAILED" if problems else "ok"))
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
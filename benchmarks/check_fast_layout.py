@@ -0,0 +1,96 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = (
+    "the of and to in is that for it as with was on be by this are from at or an which "
+    "chapter section marketing strategy audience engagement conversion funnel customer "
+    "internationalization responsibilities, well-being; résumé naïve café “quoted” — "
+    "(parenthetical) e.g. 42 3.14 1,000 Übergrößenträger supercalifragilisticexpialidocious"
+).split()
+
+
+def random_paragraph(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(1, 120))]
+    if rng.random() < 0.05:
+        # Words wider than a line are left to multi_cell
+        words.insert(rng.randrange(len(words)), "x" * rng.randint(60, 200))
+    if rng.random() < 0.05:
+        words.insert(rng.randrange(len(words)), "")
+    return " ".join(words)
+
+
+def layout(fast, font_set, family, size, start_y, text):
+    """Lays out one paragraph and returns everything written to the document."""
+    from fpdf import FPDF
+
+    from EbookGenerationAgent.tools.util.fast_layout import _fast_multi_cell
+
+    pdf = FPDF()
+    font_set.register(pdf)
+    pdf.add_page()
+    pdf.set_font(family, size=size)
+    pdf.set_y(start_y)
+    if fast:
+        _fast_multi_cell(pdf, 10, text)
+    else:
+        pdf.multi_cell(0, 10, text)
+    return [bytes(page.contents) for page in pdf.pages.values()], pdf.x, pdf.y
+
+
+def run_check(paragraphs, seed):
+    """
+    Lays out random paragraphs with fast_multi_cell and with multi_cell, in the ebook font
+    and the core font, at several sizes and positions on the page (including page breaks).
+    Returns the number of paragraphs checked, the mismatching cases and the timings.
+    """
+    from EbookGenerationAgent.tools.util import FontSet, get_font_set
+
+    rng = random.Random(seed)
+    fonts = [(FontSet("Helvetica"), "Helvetica")]
+    ebook_fonts = get_font_set()
+    if not ebook_fonts.is_core:
+        fonts.append((ebook_fonts, ebook_fonts.family))
+
+    mismatches = []
+    timings = {"fast": 0.0, "multi_cell": 0.0}
+    for index in range(paragraphs):
+        font_set, family = rng.choice(fonts)
+        # Text is sanitized for the font as in the ebook writer
+        text = font_set.sanitize(random_paragraph(rng))
+        case = (family, rng.choice([9, 10, 11, 12, 14]), rng.uniform(10, 280), text)
+        results = {}
+        for name, fast in (("fast", True), ("multi_cell", False)):
+            start = time.perf_counter()
+            results[name] = layout(fast, font_set, *case)
+            timings[name] += time.perf_counter() - start
+        if results["fast"] != results["multi_cell"]:
+            mismatches.append((index, case))
+    return paragraphs, mismatches, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that fast_multi_cell lays out paragraphs byte for byte like fpdf2's multi_cell."
+    )
+    parser.add_argument("--paragraphs", type=int, default=1500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    from fpdf import FPDF_VERSION
+
+    checked, mismatches, timings = run_check(args.paragraphs, args.seed)
+    print(f"fpdf2 {FPDF_VERSION}: {checked} paragraphs, {len(mismatches)} mismatches")
+    for name, seconds in timings.items():
+        print(f"{name:>12}  {seconds:.2f}s")
+    for index, (family, size, start_y, text) in mismatches[:10]:
+        print(f"paragraph {index}: {family} {size}pt at y={start_y:.1f}: {text[:80]!r}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
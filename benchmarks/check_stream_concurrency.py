@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai_server import FakeOpenAIServer
+
+
+async def stream(chapters, max_concurrency, prefetch_chapters):
+    from EbookGenerationAgent.tools.util import stream_ebook_chapters
+
+    return [
+        chapter async for chapter in stream_ebook_chapters(
+            "Streaming", chapters, 2, 4, "formal", "calm", max_concurrency=max_concurrency, use_cache=False,
+            prefetch_chapters=prefetch_chapters
+        )
+    ]
+
+
+def run_check(chapters, max_concurrency, prefetch_chapters):
+    """
+    Streams a book while several chapters are prefetched and returns a list of the
+    problems found: every chapter must arrive in order, and the chapters generated side
+    by side must share `max_concurrency` instead of each getting their own.
+    """
+    problems = []
+    with FakeOpenAIServer(chat_latency=0.05, latency_sigma=0.1) as fake:
+        os.environ["OPENAI_BASE_URL"] = fake.base_url
+        built = asyncio.run(stream(chapters, max_concurrency, prefetch_chapters))
+        stats = fake.stats()
+    if [chapter.heading.split(":")[0] for chapter in built] != [f"Chapter {n}" for n in range(1, chapters + 1)]:
+        problems.append(f"expected chapters 1 to {chapters} in order, got {[chapter.heading for chapter in built]}")
+    if stats["chat_in_flight_peak"] > max_concurrency:
+        problems.append(f"{stats['chat_in_flight_peak']} requests were in flight, the limit is {max_concurrency}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that streamed chapters share one concurrency limit across prefetched chapters."
+    )
+    parser.add_argument("--chapters", type=int, default=4)
+    parser.add_argument("--max-concurrency", type=int, default=2)
+    parser.add_argument("--prefetch-chapters", type=int, default=2)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="stream-check-")
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-fake",
+        "COMPLETION_CACHE_PATH": os.path.join(workdir, "completions.sqlite3"),
+    })
+    try:
+        problems = run_check(args.chapters, args.max_concurrency, args.prefetch_chapters)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    for problem in problems:
+        print(problem)
+    print("stream concurrency: " + ("FAILED" if problems else "ok"))
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
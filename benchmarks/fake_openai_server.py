@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_png(width, height, noise=True):
+    """Builds an RGB PNG in memory. Noise makes it incompressible, like a real DALL·E image."""
+    row_bytes = width * 3
+    if noise:
+        rows = b"".join(b"\x00" + os.urandom(row_bytes) for _ in range(height))
+    else:
+        rows = (b"\x00" + b"\x80" * row_bytes) * height
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows, 1)) + chunk(b"IEND", b"")
+
+
+class FakeOpenAIServer:
+    """
+    Local stand-in for the OpenAI chat completions and image generation endpoints.
+
+    Latencies are drawn from a log-normal distribution with the given median (seconds)
+    and sigma. A fraction of requests fail with a 500 (`error_rate`) or a 429
+    (`rate_limit_rate`, answered with `retry-after-ms` and `x-ratelimit-*` headers).
+    Structured-output requests for models outside `structured_output_models` are rejected
+    with a 400, like the API does for models without `json_schema` support. Generated
+    images are served from the same server. Request counters and the peak number of chat
+    requests in flight are available from `stats()` or GET /stats.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, chat_latency=0.5, image_latency=10.0, latency_sigma=0.5,
+                 error_rate=0.0, rate_limit_rate=0.0, requests_per_minute=10000, image_size=1024, seed=None,
+                 structured_output_models=("gpt-4o",)):
+        self.chat_latency = chat_latency
+        self.image_latency = image_latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.requests_per_minute = requests_per_minute
+        self.structured_output_models = tuple(structured_output_models)
+        self.random = random.Random(seed)
+        self.image = make_png(image_size, image_size)
+        self.counters = {"chat": 0, "images": 0, "downloads": 0, "errors": 0, "rate_limited": 0, "rejected": 0,
+                         "chat_in_flight_peak": 0}
+        self._chat_in_flight = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def reset_stats(self):
+        with self._lock:
+            for key in self.counters:
+                self.counters[key] = 0
+
+    def _count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def _chat_started(self):
+        with self._lock:
+            self._chat_in_flight += 1
+            self.counters["chat_in_flight_peak"] = max(self.counters["chat_in_flight_peak"], self._chat_in_flight)
+
+    def _chat_finished(self):
+        with self._lock:
+            self._chat_in_flight -= 1
+
+    def _latency(self, median):
+        with self._lock:
+            return self.random.lognormvariate(0, self.latency_sigma) * median
+
+    def _failure(self):
+        with self._lock:
+            roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            return 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500
+        return None
+
+    def _chat_completion(self, body):
+        prompt = body["messages"][-1]["content"]
+        if body.get("response_format"):
+            match = re.search(r"Write (\d+) ", prompt)
+            count = int(match.group(1)) if match else 1
+            content = json.dumps({"paragraphs": [f"Generated paragraph {i + 1}. {prompt}" for i in range(count)]})
+        else:
+            content = f"Generated paragraph. {prompt}"
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content, "refusal": None},
+                "finish_reason": "stop",
+                "logprobs": None,
+            }],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (len(prompt) + len(content)) // 4},
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, payload, content_type="application/json", headers=None):
+                data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("x-ratelimit-limit-requests", str(server.requests_per_minute))
+                self.send_header("x-ratelimit-remaining-requests", str(server.requests_per_minute - 1))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _fail(self, status):
+                if status == 429:
+                    server._count("rate_limited")
+                    self._send(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                               "code": "rate_limit_exceeded"}},
+                               headers={"retry-after-ms": "200", "x-ratelimit-reset-requests": "200ms"})
+                else:
+                    server._count("errors")
+                    self._send(500, {"error": {"message": "The server had an error", "type": "server_error"}})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path.endswith("/chat/completions"):
+                    server._count("chat")
+                    server._chat_started()
+                    try:
+                        time.sleep(server._latency(server.chat_latency))
+                    finally:
+                        server._chat_finished()
+                    if body.get("response_format") and not body.get("model", "").startswith(
+                            server.structured_output_models):
+                        server._count("rejected")
+                        return self._send(400, {"error": {
+                            "message": "Invalid parameter: 'response_format' of type 'json_schema' is not supported "
+                                       "with this model.",
+                            "type": "invalid_request_error", "param": "response_format", "code": None,
+                        }})
+                    status = server._failure()
+                    if status:
+                        return self._fail(status)
+                    return self._send(200, server._chat_completion(body))
+                if self.path.endswith("/images/generations"):
+                    server._count("images")
+                    time.sleep(server._latency(server.image_latency))
+                    status = server._failure()
+                    if status:
+                        return self._fail(status)
+                    host, port = server.httpd.server_address[:2]
+                    url = f"http://{host}:{port}/images/{uuid.uuid4().hex}.png"
+                    return self._send(200, {"created": int(time.time()), "data": [{"url": url}]})
+                self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+            def do_GET(self):
+                if self.path.startswith("/images/"):
+                    server._count("downloads")
+                    return self._send(200, server.image, content_type="image/png")
+                if self.path == "/stats":
+                    return self._send(200, server.stats())
+                self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the OpenAI API.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chat-latency", type=float, default=0.5, help="Median chat completion latency in seconds.")
+    parser.add_argument("--image-latency", type=float, default=10.0, help="Median image generation latency in seconds.")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Sigma of the log-normal latency distribution.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with a 500.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests failing with a 429.")
+    args = parser.parse_args()
+
+    fake = FakeOpenAIServer(port=args.port, chat_latency=args.chat_latency, image_latency=args.image_latency,
+                            latency_sigma=args.latency_sigma, error_rate=args.error_rate,
+                            rate_limit_rate=args.rate_limit_rate)
+    print(f"Fake OpenAI API listening on {fake.base_url} (set OPENAI_BASE_URL to use it)")
+    try:
+        fake.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
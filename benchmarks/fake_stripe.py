@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import random
+import time
+import uuid
+
+
+def sign_payload(payload, secret, timestamp=None):
+    """Returns a Stripe-Signature header for `payload`, computed the way Stripe signs webhooks."""
+    timestamp = int(timestamp or time.time())
+    signature = hmac.new(secret.encode("utf-8"), f"{timestamp}.".encode("utf-8") + payload, hashlib.sha256)
+    return f"t={timestamp},v1={signature.hexdigest()}"
+
+
+class FakeStripe:
+    """
+    Local stand-in for Stripe's webhook delivery.
+
+    Generates payment_intent.succeeded events and POSTs them to a webhook endpoint
+    signed with `secret`, like Stripe does: deliveries that are not acknowledged with a
+    2xx are retried, and a fraction of events (`duplicate_rate`) is delivered twice.
+    A fraction of requests (`bad_signature_rate`) carries a wrong signature and must be
+    rejected. Counters are available from `stats()`.
+    """
+
+    def __init__(self, url, secret, concurrency=50, duplicate_rate=0.05, bad_signature_rate=0.0, max_retries=3,
+                 seed=None):
+        self.url = url
+        self.secret = secret
+        self.concurrency = concurrency
+        self.duplicate_rate = duplicate_rate
+        self.bad_signature_rate = bad_signature_rate
+        self.max_retries = max_retries
+        self.random = random.Random(seed)
+        self.latencies = []
+        self.counters = {"events": 0, "deliveries": 0, "acknowledged": 0, "rejected": 0, "retried": 0,
+                         "duplicates": 0, "failed": 0}
+
+    def make_event(self, amount=1999, currency="usd", email=None):
+        payment_intent_id = f"pi_{uuid.uuid4().hex[:24]}"
+        return {
+            "id": f"evt_{uuid.uuid4().hex[:24]}",
+            "object": "event",
+            "type": "payment_intent.succeeded",
+            "created": int(time.time()),
+            "livemode": False,
+            "data": {"object": {
+                "id": payment_intent_id,
+                "object": "payment_intent",
+                "amount": amount,
+                "amount_received": amount,
+                "currency": currency,
+                "status": "succeeded",
+                "customer": f"cus_{uuid.uuid4().hex[:14]}",
+                "receipt_email": email or f"buyer-{payment_intent_id[3:11]}@example.com",
+                "description": "Ebook purchase",
+                "metadata": {},
+            }},
+        }
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(value):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * value / 100))] if latencies else 0.0
+
+        return {**self.counters, "p50_ms": round(percentile(50) * 1000, 2), "p99_ms": round(percentile(99) * 1000, 2)}
+
+    async def _deliver(self, client, event, bad_signature=False):
+        payload = json.dumps(event).encode("utf-8")
+        for attempt in range(self.max_retries + 1):
+            secret = "whsec_wrong" if bad_signature else self.secret
+            headers = {"Stripe-Signature": sign_payload(payload, secret), "Content-Type": "application/json"}
+            self.counters["deliveries"] += 1
+            start = time.perf_counter()
+            try:
+                response = await client.post(self.url, content=payload, headers=headers)
+            except Exception:
+                status = None
+            else:
+                status = response.status_code
+                self.latencies.append(time.perf_counter() - start)
+            if status is not None and 200 <= status < 300:
+                self.counters["acknowledged"] += 1
+                return
+            if status == 400:
+                self.counters["rejected"] += 1
+                return
+            self.counters["retried"] += 1
+            await asyncio.sleep(0.1 * 2 ** attempt)
+        self.counters["failed"] += 1
+
+    async def send(self, count):
+        """Delivers `count` new events, plus duplicates, through `concurrency` connections."""
+        import httpx
+
+        deliveries = []
+        for _ in range(count):
+            event = self.make_event()
+            self.counters["events"] += 1
+            deliveries.append((event, self.random.random() < self.bad_signature_rate))
+            if self.random.random() < self.duplicate_rate:
+                self.counters["duplicates"] += 1
+                deliveries.append((event, False))
+        self.random.shuffle(deliveries)
+
+        pending = asyncio.Queue()
+        for delivery in deliveries:
+            pending.put_nowait(delivery)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+            async def sender():
+                while not pending.empty():
+                    await self._deliver(client, *pending.get_nowait())
+
+            await asyncio.gather(*(sender() for _ in range(self.concurrency)))
+        return self.stats()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deliver signed fake Stripe webhook events to an endpoint.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/webhook")
+    parser.add_argument("--secret", required=True, help="The endpoint's STRIPE_WEBHOOK_SECRET.")
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duplicate-rate", type=float, default=0.05)
+    parser.add_argument("--bad-signature-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = FakeStripe(args.url, args.secret, concurrency=args.concurrency, duplicate_rate=args.duplicate_rate,
+                      bad_signature_rate=args.bad_signature_rate)
+    start = time.perf_counter()
+    stats = asyncio.run(fake.send(args.events))
+    print(json.dumps({**stats, "seconds": round(time.perf_counter() - start, 2)}, indent=2))